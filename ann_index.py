@@ -0,0 +1,292 @@
+import heapq
+import random
+import time
+
+class RandomHyperplaneLSH(object):
+    """Approximate nearest neighbors for cosine similarity and pearson.
+
+    Every vector is hashed to n_bits signs of its dot product with random
+    gaussian hyperplanes, once per table. A query only scores the vectors
+    that share a bucket with it in at least one table. More tables raise
+    recall, more bits make buckets smaller and queries faster."""
+
+    def __init__(self, vectors, score, metric='cosine_similarity', n_bits=8,
+            n_tables=4, seed=None):
+        self.buckets  = [{} for i in range(n_tables)]
+        self.metric   = metric
+        self.n_bits   = n_bits
+        self.n_tables = n_tables
+        self.planes   = {}
+        self.random   = random.Random(seed)
+        self.score    = score
+        self.vectors  = vectors
+
+        for key in vectors:
+            for table, signature in enumerate(self.signatures(vectors[key])):
+                self.buckets[table].setdefault(signature, []).append(key)
+
+    def candidates(self, vector):
+        keys = set()
+        for table, signature in enumerate(self.signatures(vector)):
+            keys.update(self.buckets[table].get(signature, ()))
+        return keys
+
+    def query(self, vector, k=1, exclude=None):
+        """[(similarity, key)] for the k most similar candidates."""
+        array = []
+        for key in self.candidates(vector):
+            if key != exclude:
+                try:
+                    array.append((self.score(vector, self.vectors[key]), key))
+                except ZeroDivisionError:
+                    continue
+        return heapq.nlargest(k, array)
+
+    def signatures(self, vector):
+        if self.metric == 'pearson':
+            # Pearson is the cosine of the mean-centered vectors
+            average = sum(vector.values()) / float(max(len(vector), 1))
+            vector  = dict((k, v - average) for (k, v) in vector.items())
+
+        dots = [0] * (self.n_bits * self.n_tables)
+        for dimension, value in vector.items():
+            plane = self.__plane(dimension)
+            for i in range(len(dots)):
+                dots[i] += value * plane[i]
+
+        signatures = []
+        for table in range(self.n_tables):
+            bits = dots[table * self.n_bits:(table + 1) * self.n_bits]
+            signatures.append(tuple([dot >= 0 for dot in bits]))
+        return signatures
+
+    def __plane(self, dimension):
+        # Hyperplane components are drawn the first time a dimension is seen
+        if dimension not in self.planes:
+            self.planes[dimension] = [
+                self.random.gauss(0, 1)
+                for i in range(self.n_bits * self.n_tables)
+            ]
+        return self.planes[dimension]
+
+class VantagePointTree(object):
+    """Nearest neighbors for manhattan, euclidean and minkowski distances
+    over dense vectors, such as the item attributes of ContentRecommender.
+
+    Each node keeps a vantage point and the median distance from it; a
+    query skips the side of a node that can't hold anything closer than the
+    current k-th neighbor. That relies on the triangle inequality, which
+    the dense kernels in metrics satisfy. The dict metrics only compare the
+    attributes two vectors share, which is a metric only when every vector
+    has the same attributes, so {attribute: value} vectors must all have
+    the same ones and a ValueError is raised otherwise. Sparse rating rows
+    don't qualify; use Recommender.nearest_users for those.
+
+    epsilon = 0 returns the exact k nearest under score; epsilon > 0 prunes
+    more aggressively, trading recall for speed."""
+
+    def __init__(self, vectors, score, epsilon=0, leaf_size=8, seed=None):
+        self.epsilon   = epsilon
+        self.leaf_size = leaf_size
+        self.positions = None
+        self.random    = random.Random(seed)
+        self.score     = score
+
+        if any([hasattr(v, 'keys') for v in vectors.values()]):
+            # In the order the vectors list their attributes, which is the
+            # order the dict metrics add them up in, so distances match
+            # exactly
+            self.positions = {}
+            for vector in vectors.values():
+                for attribute in vector:
+                    self.positions.setdefault(attribute, len(self.positions))
+            vectors = dict((key, self.dense(vectors[key])) for key in vectors)
+        self.vectors   = vectors
+        self.root      = self.__build(list(vectors.keys()))
+
+    def dense(self, vector):
+        """vector as a list over the tree's attributes, if it is a dict.
+        Raises ValueError when it lacks one of them; attributes the tree
+        wasn't built with are left out."""
+        if self.positions is None or not hasattr(vector, 'keys'):
+            return vector
+        dense = [None] * len(self.positions)
+        for attribute, position in self.positions.items():
+            if attribute not in vector:
+                raise ValueError('Vector has no {!r}: a vantage point tree '
+                    'needs the same attributes in every vector'.format(
+                    attribute))
+            dense[position] = vector[attribute]
+        return dense
+
+    def query(self, vector, k=1, exclude=None):
+        """[(distance, key)] for the k nearest vectors, nearest first."""
+        vector = self.dense(vector)
+        heap = []
+        self.__search(self.root, vector, k, exclude, heap)
+        return sorted([(-distance, key) for (distance, key) in heap])
+
+    # Private methods
+
+    def __build(self, keys):
+        if len(keys) <= self.leaf_size:
+            return ('leaf', keys)
+
+        vantage = keys.pop(self.random.randrange(len(keys)))
+        point   = self.vectors[vantage]
+        distances = sorted(
+            [(self.score(point, self.vectors[key]), key) for key in keys]
+        )
+        middle = len(distances) // 2
+        radius = distances[middle][0]
+
+        inner = [key for (distance, key) in distances[:middle]]
+        outer = [key for (distance, key) in distances[middle:]]
+        return ('node', vantage, radius,
+            self.__build(inner), self.__build(outer))
+
+    def __push(self, heap, k, distance, key):
+        # heap holds the k nearest so far as (-distance, key)
+        if len(heap) < k:
+            heapq.heappush(heap, (-distance, key))
+        elif distance < -heap[0][0]:
+            heapq.heapreplace(heap, (-distance, key))
+
+    def __search(self, node, vector, k, exclude, heap):
+        if node[0] == 'leaf':
+            for key in node[1]:
+                if key != exclude:
+                    self.__push(
+                        heap, k, self.score(vector, self.vectors[key]), key
+                    )
+            return
+
+        tag, vantage, radius, inner, outer = node
+        distance = self.score(vector, self.vectors[vantage])
+        if vantage != exclude:
+            self.__push(heap, k, distance, vantage)
+
+        if distance < radius:
+            near, far = inner, outer
+        else:
+            near, far = outer, inner
+        self.__search(near, vector, k, exclude, heap)
+
+        if len(heap) < k:
+            tau = float('inf')
+        else:
+            tau = -heap[0][0] / (1.0 + self.epsilon)
+        if abs(distance - radius) <= tau:
+            self.__search(far, vector, k, exclude, heap)
+
+def recall_at_k(index, vectors, exact, k=10, queries=None, similarity=False):
+    """Fraction of the exact k nearest neighbors the index returns, averaged
+    over the query keys, along with the mean seconds per query for both.
+    exact(key) is the search the index stands in for, such as
+    compute_nearest_neighbor: (score, key) for every other key, best first.
+    A neighbor tied with the exact k-th one counts as found, since which
+    of the tied ones make the top k is arbitrary."""
+    if queries is None:
+        queries = list(vectors.keys())
+
+    hits  = 0
+    total = 0
+    approximate_time = 0
+    exact_time       = 0
+
+    for key in queries:
+        start = time.time()
+        found = index.query(vectors[key], k, key)
+        approximate_time += time.time() - start
+
+        start = time.time()
+        nearest = exact(key)[:k]
+        exact_time += time.time() - start
+
+        if nearest:
+            bound = nearest[-1][0]
+            if similarity:
+                good = [d for (d, n) in found if d >= bound]
+            else:
+                good = [d for (d, n) in found if d <= bound]
+            hits += min(len(good), len(nearest))
+        total += len(nearest)
+
+    return {
+        'recall': float(hits) / max(total, 1),
+        'approximate_seconds': approximate_time / max(len(queries), 1),
+        'exact_seconds': exact_time / max(len(queries), 1),
+    }
+
+def benchmark(users=2000, items=60, attributes=8, tastes=20, k=10, seed=0):
+    """Recall@k and query time of each index against the exact search it
+    stands in for. LSH runs over users drawn from a few taste profiles who
+    each rate most of the items, against cosine_similarity_all and
+    pearson_all. The vantage point tree runs over items with a value for
+    every attribute, against ContentRecommender.compute_nearest_neighbor
+    for manhattan and the dict euclidean for euclidean."""
+    from content_recommender import ContentRecommender
+
+    generator = random.Random(seed)
+    profiles  = [[generator.uniform(1, 5) for i in range(items)]
+        for t in range(tastes)]
+
+    data = {}
+    for u in range(users):
+        profile = generator.choice(profiles)
+        data['user{}'.format(u)] = dict(
+            ('item{}'.format(i), round(profile[i] + generator.gauss(0, 0.5)))
+            for i in range(items) if generator.random() < 0.8
+        )
+
+    # As many items with attributes as there are users
+    vectors = {}
+    for v in range(users):
+        profile = generator.choice(profiles)
+        vectors['item{}'.format(v)] = dict(
+            ('attribute{}'.format(a),
+                round(profile[a] + generator.gauss(0, 0.5), 1))
+            for a in range(attributes)
+        )
+
+    r = ContentRecommender(data)
+    user_queries = generator.sample(sorted(data.keys()), 50)
+    item_queries = generator.sample(sorted(vectors.keys()), 50)
+
+    def ranking(scores):
+        return sorted([(s, key) for (key, s) in scores.items()],
+            reverse=True)
+
+    exact = {
+        'cosine_similarity': lambda key: ranking(r.cosine_similarity_all(key)),
+        'pearson': lambda key: ranking(r.pearson_all(key)),
+        'manhattan': lambda key: r.compute_nearest_neighbor(
+            key, vectors[key], vectors),
+        'euclidean': lambda key: sorted([
+            (r.euclidean(vectors[key], vectors[other]), other)
+            for other in vectors if other != key
+        ]),
+    }
+
+    for metric, options in [
+        ('cosine_similarity', {'n_bits': 12, 'n_tables': 4}),
+        ('cosine_similarity', {'n_bits': 12, 'n_tables': 16}),
+        ('pearson', {'n_bits': 6, 'n_tables': 8}),
+        ('manhattan', {'epsilon': 0}),
+        ('manhattan', {'epsilon': 0.5}),
+        ('euclidean', {'epsilon': 0}),
+    ]:
+        if metric in ['cosine_similarity', 'pearson']:
+            index = r.build_ann_index(metric, seed=seed, **options)
+            result = recall_at_k(index, data, exact[metric], k,
+                user_queries, True)
+        else:
+            index = r.build_ann_index(metric, vectors, seed=seed, **options)
+            result = recall_at_k(index, vectors, exact[metric], k,
+                item_queries)
+        print('{} {}: recall@{} {:.3f}, {:.5f}s vs {:.5f}s exact'.format(
+            metric, options, k, result['recall'],
+            result['approximate_seconds'], result['exact_seconds']
+        ))
+
+# benchmark()
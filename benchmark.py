@@ -0,0 +1,310 @@
+import argparse
+import bisect
+import gc
+import json
+import platform
+import random
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import metrics
+
+from content_recommender import ContentRecommender
+from item_recommender import ItemRecommender
+from recommender import Recommender
+
+METRICS     = ['manhattan', 'euclidean', 'minkowski', 'pearson',
+    'cosine_similarity']
+MIN_SECONDS = 0.2
+REPEAT      = 5
+SIZES       = [1000, 10000, 100000, 1000000]
+
+def generate_ratings(users, items=10000, ratings_per_user=20, alpha=1.1,
+        seed=0):
+    """Synthetic {user: {item: rating}} data. Item popularity follows a
+    power law (item i is picked with weight 1 / (i + 1) ** alpha) and so
+    does the number of items each user rates, with the given mean."""
+    generator = random.Random(seed)
+
+    cumulative = []
+    total = 0
+    for i in range(items):
+        total += 1.0 / pow(i + 1, alpha)
+        cumulative.append(total)
+
+    data = {}
+    for u in range(users):
+        count = min(items, max(1, int(
+            generator.paretovariate(2.0) * ratings_per_user / 2.0
+        )))
+        ratings = {}
+        while len(ratings) < count:
+            i = bisect.bisect(cumulative, generator.random() * total)
+            ratings['item{}'.format(i)] = generator.choice(
+                [1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5]
+            )
+        data['user{}'.format(u)] = ratings
+    return data
+
+def generate_items(items=1000, attributes=7, seed=0):
+    """Synthetic item attribute vectors for ContentRecommender."""
+    generator = random.Random(seed)
+    names = ['attribute{}'.format(a) for a in range(attributes)]
+    return dict(
+        ('item{}'.format(i),
+            dict((name, generator.randint(1, 5)) for name in names))
+        for i in range(items)
+    )
+
+def measure(name, size, calls, function, repeat=REPEAT):
+    """Time function() like timeit: run it in a loop long enough to take
+    at least MIN_SECONDS, repeat that loop and keep the fastest. Then run
+    it once more under tracemalloc for its peak memory."""
+    return measure_all([(name, size, calls, function)], repeat)[0]
+
+def measure_all(benchmarks, repeat=REPEAT):
+    """measure() each (name, size, calls, function), taking the repeats
+    in rounds across all of them so a stretch of time when the machine is
+    slow costs every benchmark one run rather than one benchmark all of
+    them."""
+    loops = []
+    for (name, size, calls, function) in benchmarks:
+        number = 1
+        while True:
+            elapsed, count = _time(function, number)
+            if elapsed >= MIN_SECONDS:
+                break
+            number *= 10 if elapsed * 10 < MIN_SECONDS else 2
+        loops.append([number, count, elapsed / number])
+
+    for i in range(repeat - 1):
+        for (loop, benchmark) in zip(loops, benchmarks):
+            seconds = _time(benchmark[3], loop[0])[0] / loop[0]
+            loop[2] = min(loop[2], seconds)
+
+    results = []
+    for ((name, size, calls, function), (number, count, seconds)) in zip(
+            benchmarks, loops):
+        peak = None
+        if tracemalloc is not None:
+            gc.collect()
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        results.append({
+            'name': name,
+            'users': size,
+            'calls': count,
+            'seconds': seconds,
+            'per_call': seconds / max(count, 1),
+            'throughput': count / seconds if seconds else None,
+            'peak_memory': peak,
+            'number': number,
+            'repeat': repeat,
+        })
+    return results
+
+def run(sizes, items=10000, calls=20, seed=0, repeat=REPEAT):
+    results   = []
+    generator = random.Random(seed)
+
+    for size in sizes:
+        print('Generating {} users'.format(size))
+        data  = generate_ratings(size, items, seed=seed)
+        users = generator.sample(sorted(data.keys()), min(calls, size))
+        pairs = list(zip(users, reversed(users)))
+
+        r = Recommender(data)
+        r.rating_matrix()
+        benchmarks = []
+        for metric in METRICS:
+            benchmarks.append((metric, size, len(pairs),
+                lambda metric=metric: _pairs(r, metric, pairs)))
+            benchmarks.append((metric + '_all', size, len(users),
+                lambda metric=metric: _each(getattr(r, metric + '_all'),
+                    users)))
+        benchmarks.append(('recommend', size, len(users),
+            lambda: _each(r.recommend, users)))
+        benchmarks.append(('recommend_k10', size, len(users),
+            lambda: _each(lambda u: r.recommend(u, 10, 10), users)))
+
+        # The unfitted item-based calls scan every user per item pair, so
+        # only a few of them are timed, before fitting
+        item = ItemRecommender(data)
+        few  = [(u, _unrated(data, u)) for u in users[:3]]
+        benchmarks.append(('predict', size, len(few),
+            lambda: _safe(item.predict, few)))
+        benchmarks.append(('weighted_slope_one', size, len(few),
+            lambda: _safe(item.weighted_slope_one, few)))
+        results.extend(measure_all(benchmarks, repeat))
+
+        item.fit()
+        item.compute_deviations()
+        many = [(u, _unrated(data, u)) for u in users]
+        results.extend(measure_all([
+            ('predict_fitted', size, len(many),
+                lambda: _safe(item.predict, many)),
+            ('weighted_slope_one_fitted', size, len(many),
+                lambda: _safe(item.weighted_slope_one, many)),
+        ], repeat))
+
+        # Python 2 can't del names the lambdas above close over
+        r = item = data = benchmarks = None
+
+    results.extend(run_metrics(calls=calls, seed=seed, repeat=repeat))
+
+    content = ContentRecommender()
+    vectors = generate_items(seed=seed)
+    content.data = {'user': dict((k, 3) for k in vectors)}
+    queries = generator.sample(sorted(vectors.keys()), calls)
+    results.append(measure('classify', len(vectors), len(queries),
+        lambda: _each(
+            lambda k: content.classify('user', k, vectors[k], vectors),
+            queries
+        ), repeat))
+
+    return {
+        'python': platform.python_version(),
+        'items': items,
+        'repeat': repeat,
+        'seed': seed,
+        'sizes': sizes,
+        'results': results,
+    }
+
+def run_metrics(rows=1000, dimensions=16, calls=20, seed=0,
+        repeat=REPEAT):
+    """Micro-benchmark of each metric kernel on dense random vectors:
+    scalar calls, one query against rows vectors, and a calls x rows
+    table."""
+    generator = random.Random(seed)
+    matrix  = [[generator.uniform(1, 5) for d in range(dimensions)]
+        for i in range(rows)]
+    queries = matrix[:calls]
+
+    benchmarks = []
+    for metric in sorted(metrics.METRICS):
+        kernel = metrics.kernel(metric)
+        benchmarks.append(('metric_' + metric, rows, rows,
+            lambda kernel=kernel: _each(
+                lambda row: kernel(queries[0], row), matrix
+            )))
+        benchmarks.append(('metric_' + metric + '_one_vs_many', rows,
+            len(queries), lambda metric=metric: _each(
+                lambda query: metrics.one_vs_many(query, matrix, metric),
+                queries
+            )))
+        benchmarks.append(('metric_' + metric + '_many_vs_many', rows, 1,
+            lambda metric=metric: len([
+                metrics.many_vs_many(queries, matrix, metric)
+            ])))
+    return measure_all(benchmarks, repeat)
+
+def compare(current, baseline, tolerance=0.2):
+    """Benchmarks whose time per call grew by more than tolerance."""
+    previous = dict(((r['name'], r['users']), r)
+        for r in baseline['results'])
+
+    regressions = []
+    for result in current['results']:
+        old = previous.get((result['name'], result['users']))
+        if old and result['per_call'] > old['per_call'] * (1 + tolerance):
+            regressions.append((result['name'], result['users'],
+                old['per_call'], result['per_call']))
+    return regressions
+
+def _each(function, keys):
+    for key in keys:
+        function(key)
+    return len(keys)
+
+def _pairs(r, metric, pairs):
+    for (user1, user2) in pairs:
+        try:
+            getattr(r, metric)(r.data[user1], r.data[user2])
+        except ZeroDivisionError:
+            continue
+    return len(pairs)
+
+def _safe(function, pairs):
+    for (key1, key2) in pairs:
+        try:
+            function(key1, key2)
+        except ZeroDivisionError:
+            continue
+    return len(pairs)
+
+def _time(function, number):
+    gc.collect()
+    start = timeit.default_timer()
+    for i in range(number):
+        count = function()
+    return (timeit.default_timer() - start, count)
+
+def _unrated(data, user):
+    # The most popular item the user hasn't rated
+    i = 0
+    while 'item{}'.format(i) in data[user]:
+        i += 1
+    return 'item{}'.format(i)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the recommenders on synthetic ratings.'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES[:2],
+        help='numbers of users, up to {}'.format(SIZES[-1]))
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+        help='runs of each benchmark, of which the fastest is kept')
+    parser.add_argument('--metrics-only', action='store_true',
+        help='only run the metric kernel micro-benchmark')
+    args = parser.parse_args(argv)
+
+    if args.metrics_only:
+        report = {
+            'python': platform.python_version(),
+            'repeat': args.repeat,
+            'results': run_metrics(calls=args.calls, seed=args.seed,
+                repeat=args.repeat),
+        }
+    else:
+        report = run(args.sizes, args.items, args.calls, args.seed,
+            args.repeat)
+    f = open(args.output, 'w')
+    f.write(json.dumps(report, indent=2, sort_keys=True))
+    f.close()
+
+    for r in report['results']:
+        print('{:<40} {:>8} users  {:.6f}s/call  {}'.format(
+            r['name'], r['users'], r['per_call'],
+            '{} bytes peak'.format(r['peak_memory'])
+            if r['peak_memory'] is not None else ''
+        ))
+
+    if args.baseline:
+        f = open(args.baseline, 'r')
+        baseline = json.loads(f.read())
+        f.close()
+
+        regressions = compare(report, baseline, args.tolerance)
+        for name, users, old, new in regressions:
+            print('REGRESSION {} ({} users): {:.6f}s -> {:.6f}s'.format(
+                name, users, old, new))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
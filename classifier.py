@@ -1,59 +1,252 @@
+import heapq
+import multiprocessing
+import os
+import sys
+import time
+
+import metrics
+
+from column_store import load_columns
 from content_recommender import ContentRecommender
+from prototype_reduction import condense, edit
+from spatial_index import LinearScan, build_index
+from training_set import TrainingSet
+
+# Rough bytes per entry of a distance table: a float object and its pointer
+DISTANCE_SIZE = sys.getsizeof(1.0) + 8
+
+TEST_SUFFIX     = '_test_set.txt'
+TRAINING_SUFFIX = '_training_set.txt'
 
 class Classifier(ContentRecommender):
     def __init__(self, data=[]):
-        self.data   = data
-        self.format = []
-        self.mean_and_deviation   = []
-        self.median_and_deviation = []
-        self.normalize_min_max    = []
+        super(Classifier, self).__init__(data)
+        self.columns = None
+        self.format  = []
+        self.reset_scaling()
 
     def classify(self, vector, strategy='normalize'):
         return self.nearest_neighbor(self.standardize(vector, strategy))[1][0]
 
-    def standardize(self, vector, strategy):
-        if strategy == 'standardize':
+    def classify_many(self, matrix, strategy='normalize', k=1,
+            max_memory=64 * 1024 * 1024):
+        """Classify every vector in matrix: scale them, look up each one's k
+        nearest training rows in the spatial index fit builds, and vote as
+        in knn. Returns the list of labels, the same ones classify (k=1)
+        would give one at a time.
+
+        When the index is a linear scan, because no tree prunes the data
+        well, the vectors are instead taken in blocks whose table of
+        distances to the training rows fits in max_memory bytes."""
+        if not self.fitted:
+            self.fit(strategy)
+        matrix = [self.standardize(vector, strategy) for vector in matrix]
+        # Training rows in index order, so ties go to the same row as in
+        # nearest_neighbor
+        labels = [self.data[i][0] for i in self.index_order]
+
+        if not isinstance(self.index, LinearScan):
+            return [self.__vote_nearest(labels,
+                [i for (distance, i) in self.index.query(vector, k)])
+                for vector in matrix]
+
+        points = [list(self.data[i][1]) for i in self.index_order]
+        block  = max(1, max_memory // (DISTANCE_SIZE * max(len(points), 1)))
+
+        results = []
+        for start in range(0, len(matrix), block):
+            table = metrics.many_vs_many(matrix[start:start + block], points,
+                self.metric)
+            for distances in table:
+                results.append(self.__vote_nearest(labels,
+                    heapq.nsmallest(k, range(len(distances)),
+                        key=distances.__getitem__)))
+        return results
+
+    def fit(self, strategy='normalize', metric='euclidean', scaler=None):
+        """Scale the training data once and keep the column parameters, so
+        queries only need to be transformed. strategy is 'normalize',
+        'standardize' or None for no scaling. A spatial index over the
+        scaled data then answers neighbor queries with metric, 'euclidean'
+        or 'manhattan'.
+
+        A fitted StreamingScaler supplies the strategy and parameters
+        instead, e.g. ones computed in a pass over a file too large to
+        load."""
+        if self.fitted:
+            raise ValueError(
+                'Already fitted with {}, reload the data to fit again'.format(
+                    self.strategy
+                )
+            )
+
+        self.median_and_deviation = []
+        self.normalize_min_max    = []
+        if scaler is not None:
+            strategy = scaler.strategy
+            if strategy == 'standardize':
+                self.median_and_deviation = list(scaler.parameters)
+            else:
+                self.normalize_min_max = list(scaler.parameters)
+            self.strategy = strategy
+            for v in self.data:
+                v[1][:] = self.transform(v[1])
+        elif strategy == 'standardize':
             self.standardize_columns()
-            return self.standardize_vector(vector)
         elif strategy == 'normalize':
             self.normalize_columns()
+        elif strategy is not None:
+            raise ValueError('Unknown strategy: {}'.format(strategy))
+
+        self.fitted   = True
+        self.metric   = metric
+        self.strategy = strategy
+        self.build_index()
+
+    def build_index(self):
+        # Build over the rows in sorted order, so that ties between equally
+        # distant rows break the same way sorting (distance, row) does. The
+        # class and values come first so whole rows are rarely compared.
+        self.index_order = sorted(range(len(self.data)),
+            key=self.sort_key)
+        self.index = build_index(
+            [list(self.data[i][1]) for i in self.index_order], self.metric
+        )
+
+    def reduce(self, method='condense', k=3):
+        """Keep only a subset of the fitted training rows as prototypes, so
+        queries compare against fewer rows. method is 'condense' (Hart's
+        condensed nearest neighbor), 'edit' (Wilson editing with k
+        neighbors) or 'edit_condense', which edits out noisy rows before
+        condensing. Returns the compression ratio, rows before over rows
+        after."""
+        if not self.fitted:
+            raise ValueError('Fit before reducing the training rows')
+        if method not in ['condense', 'edit', 'edit_condense']:
+            raise ValueError('Unknown reduction: {}'.format(method))
+
+        # Work in index order so ties break as they do in classification
+        points = [list(self.data[i][1]) for i in self.index_order]
+        labels = [self.data[i][0] for i in self.index_order]
+        kept   = list(range(len(points)))
+        if method in ['edit', 'edit_condense']:
+            kept = edit(points, labels, k, self.metric, self.vote)
+        if method in ['condense', 'edit_condense']:
+            kept = [kept[i] for i in condense(
+                [points[i] for i in kept], [labels[i] for i in kept],
+                self.metric
+            )]
+
+        before = len(self.data)
+        rows   = sorted([self.index_order[i] for i in kept])
+        if isinstance(self.data, TrainingSet):
+            self.data = self.data.subset(rows)
+        else:
+            self.data = [self.data[i] for i in rows]
+        self.build_index()
+        return float(before) / max(len(self.data), 1)
+
+    def reset_scaling(self):
+        self.fitted   = False
+        self.index    = None
+        self.metric   = 'euclidean'
+        self.strategy = None
+        self.mean_and_deviation   = []
+        self.median_and_deviation = []
+        self.normalize_min_max    = []
+
+    def sort_key(self, i):
+        v = self.data[i]
+        return (v[0], list(v[1]), v)
+
+    def standardize(self, vector, strategy):
+        """Scale a query vector, fitting the training data on first use."""
+        if not self.fitted:
+            self.fit(strategy)
+        elif strategy != self.strategy:
+            raise ValueError('Fitted with {}, not {}'.format(
+                self.strategy, strategy
+            ))
+        return self.transform(vector)
+
+    def use_columns(self, columns):
+        """Train on a copy of already loaded columns."""
+        self.reset_scaling()
+
+        self.columns = columns
+        self.format  = columns.format
+        self.data    = TrainingSet.from_columns(columns)
+
+    def use_metric(self, metric):
+        """Answer neighbor queries with another metric, keeping the scaled
+        training data."""
+        if not self.fitted:
+            raise ValueError('Fit before choosing a metric')
+        if metric != self.metric or self.index is None:
+            self.metric = metric
+            self.build_index()
+
+    def vote(self, categories):
+        """Most common category; on a tie, the one that came first."""
+        votes = {}
+        for category in categories:
+            votes.setdefault(category, 0)
+            votes[category] += 1
+
+        winning_category = None
+        category_count   = 0
+
+        # In the order the categories came, not dict order, so the first
+        # of the tied ones wins on Python 2 as well
+        for category in categories:
+            if votes[category] > category_count:
+                winning_category = category
+                category_count   = votes[category]
+
+        return winning_category
+
+    def votes_by_k(self, categories):
+        """vote(categories[:k]) for every k from 1 to len(categories), in
+        one pass: each category added can only overtake the winner so far."""
+        votes   = {}
+        seen    = {}
+        winners = []
+
+        winning_category = None
+        for category in categories:
+            if category not in votes:
+                votes[category] = 0
+                seen[category]  = len(seen)
+            votes[category] += 1
+
+            if winning_category is None:
+                winning_category = category
+            elif (votes[category], -seen[category]) > (
+                    votes[winning_category], -seen[winning_category]):
+                winning_category = category
+            winners.append(winning_category)
+
+        return winners
+
+    def transform(self, vector):
+        if self.strategy == 'standardize':
+            return self.standardize_vector(vector)
+        elif self.strategy == 'normalize':
             return self.normalize_vector(vector)
+        return list(vector)
 
     def euclidean(self, vector1, vector2):
-        array = map(lambda v1, v2: pow(v1 - v2, 2), vector1, vector2)
-        return pow(sum(array), 0.5)
-
-    def load_data(self, file_name):
-        self.data = []
-
-        f = open('sets/{}.txt'.format(file_name), 'r')
-        lines = f.readlines()
-        f.close()
-
-        self.format = [w.strip().replace('\n', '') for w in lines[0].split(',')]
-
-        for line in lines[1:]:
-            fields = [w.strip().replace('\n', '') for w in line.split(',')]
-            ignore = []
-            vector = []
-            for i in range(len(fields)):
-                if self.format[i] == 'num':
-                    vector.append(float(fields[i]))
-                elif self.format[i] == 'comment':
-                    ignore.append(fields[i])
-                elif self.format[i] == 'class':
-                    classification = fields[i]
-            self.data.append((classification, vector, ignore))
+        return metrics.euclidean(vector1, vector2)
 
-    def manhattan(self, vector1, vector2):
-        # length = min(len(vector1), len(vector2))
-        # distance = 0
-        # for i in range(length):
-        #     distance += abs(vector1[i] - vector2[i])
-        # return distance
+    def load_data(self, file_name, typecode='d'):
+        """Load sets/<file_name>.txt through its cached columnar sidecar.
+        typecode 'f' keeps the columns as float32."""
+        self.use_columns(
+            load_columns('sets/{}.txt'.format(file_name), typecode)
+        )
 
-        array = map(lambda v1, v2: abs(v1 - v2), vector1, vector2)
-        return sum(array)
+    def manhattan(self, vector1, vector2):
+        return metrics.manhattan(vector1, vector2)
 
     def nearest_neighbor(self, vector):
         # array = []
@@ -62,18 +255,33 @@ class Classifier(ContentRecommender):
         #     array.append((distance, v))
         # return sorted(array)
 
-        return min(self.nearest_neighbors(vector))
+        return self.nearest_neighbors(vector, 1)[0]
+
+    def nearest_neighbors(self, vector, k=None):
+        """(distance, row) for the k nearest rows, or every row when k is
+        None, nearest first."""
+        if k is not None and self.index is not None:
+            return [(distance, self.data[self.index_order[i]])
+                for (distance, i) in self.index.query(vector, k)]
 
-    def nearest_neighbors(self, vector):
-        return sorted([(self.euclidean(vector, v[1]), v) for v in self.data])
+        distance = getattr(self, self.metric)
+        array = [(distance(vector, v[1]), v) for v in self.data]
+        if k is None:
+            return sorted(array)
+        return heapq.nsmallest(k, array)
+
+    def column(self, col_number):
+        if isinstance(self.data, TrainingSet):
+            return self.data.column(col_number)
+        return [v[1][col_number] for v in self.data]
 
     def normalize_column(self, col_number):
-        values = [v[1][col_number] for v in self.data]
+        values = self.column(col_number)
         max_r  = max(values)
         min_r  = min(values)
         self.normalize_min_max.append((min_r, max_r))
-        for v in self.data:
-            v[1][col_number] = (v[1][col_number] - min_r) / (max_r - min_r)
+        self.set_column(col_number,
+            [(x - min_r) / (max_r - min_r) for x in values])
 
     def normalize_columns(self):
         for i in range(len(self.data[0][1])):
@@ -87,15 +295,21 @@ class Classifier(ContentRecommender):
             vector[i] = (vector[i] - min_r) / (max_r - min_r)
         return vector
 
+    def set_column(self, col_number, values):
+        if isinstance(self.data, TrainingSet):
+            self.data.set_column(col_number, values)
+        else:
+            for (v, x) in zip(self.data, values):
+                v[1][col_number] = x
+
     def standardize_column(self, col_number):
-        values = [v[1][col_number] for v in self.data]
+        column = self.column(col_number)
+        values = self.column_statistics(column)
         self.median_and_deviation.append(
-            (self.median(values), self.absolute_standard_deviation(values))
+            (values.median, values.absolute_standard_deviation)
         )
-        for v in self.data:
-            v[1][col_number] = self.modified_standard_score(
-                v[1][col_number], values
-            )
+        self.set_column(col_number,
+            [self.modified_standard_score(x, values) for x in column])
 
     def standardize_columns(self):
         """Standardize all the existing columns."""
@@ -109,6 +323,14 @@ class Classifier(ContentRecommender):
             vector[i] = (vector[i] - median) / asd
         return vector
 
+    # Private methods
+
+    def __vote_nearest(self, labels, nearest):
+        # nearest are positions in index order, nearest first
+        if len(nearest) == 1:
+            return labels[nearest[0]]
+        return self.vote([labels[i] for i in nearest])
+
 
 def unit_test():
     list1 = [54, 72, 78, 49, 65, 63, 75, 67, 54]
@@ -126,9 +348,10 @@ def test_training_set(set_type, standardize=None):
     c2 = Classifier()
     c2.load_data('{}_test_set'.format(set_type))
 
+    labels  = c1.classify_many([v[1] for v in c2.data], standardize)
     correct = 0
-    for v in c2.data:
-        if v[0] == c1.classify(v[1], standardize):
+    for v, label in zip(c2.data, labels):
+        if v[0] == label:
             correct += 1
 
     accuracy   = float(correct) / len(c2.data)
@@ -138,10 +361,103 @@ def test_training_set(set_type, standardize=None):
     print('{} ({}): {}{} accuracy'.format(set_type.capitalize(),
         standardize, percentage, '%'))
 
-def test_all_training_sets():
-    for method in ['standardize', 'normalize']:
-        for name in ['atheletes', 'iris', 'mpg']:
-            test_training_set(name, method)
+def test_all_training_sets(jobs=None):
+    results = run_training_sets(jobs=jobs)
+    print_results(results)
+    return results
+
+def discover_training_sets(folder='sets'):
+    """Names that have both a <name>_training_set.txt and a
+    <name>_test_set.txt in folder."""
+    names = []
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(TRAINING_SUFFIX):
+            name = file_name[:-len(TRAINING_SUFFIX)]
+            if os.path.exists(os.path.join(folder, name + TEST_SUFFIX)):
+                names.append(name)
+    return names
+
+def print_results(results):
+    print('{:<12} {:<12} {:>9} {:>9} {:>9}'.format(
+        'dataset', 'strategy', 'accuracy', 'load', 'test'))
+    for r in results:
+        if r['error']:
+            print('{:<12} {:<12} {}'.format(
+                r['dataset'], r['strategy'], r['error']))
+        else:
+            print('{:<12} {:<12} {:>8.2f}% {:>8.3f}s {:>8.3f}s'.format(
+                r['dataset'], r['strategy'], r['accuracy'] * 100,
+                r['load_seconds'], r['seconds']))
+
+def run_training_sets(names=None, strategies=['standardize', 'normalize'],
+        jobs=None):
+    """Classify the test set of every dataset (all of sets/ by default)
+    with every strategy, across jobs processes (one per CPU by default).
+
+    Returns one dict per (dataset, strategy) with the accuracy, the number
+    correct out of total, load_seconds spent parsing the dataset (0 once a
+    worker has it), seconds spent fitting and classifying, and error, the
+    reason the job failed or None."""
+    if names is None:
+        names = discover_training_sets()
+    tasks = [(name, strategy) for name in names for strategy in strategies]
+    if jobs == 1:
+        return [_run_training_job(task) for task in tasks]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # Each chunk is one dataset's jobs, so a dataset is loaded by one
+        # worker, once
+        return pool.map(_run_training_job, tasks, max(len(strategies), 1))
+    finally:
+        pool.terminate()
+
+# Columns parsed by this process, by dataset name
+_training_sets = {}
+
+def _load_training_set(name):
+    if name not in _training_sets:
+        _training_sets[name] = (
+            load_columns('sets/{}{}'.format(name, TRAINING_SUFFIX)),
+            load_columns('sets/{}{}'.format(name, TEST_SUFFIX)),
+        )
+    return _training_sets[name]
+
+def _run_training_job(task):
+    name, strategy = task
+    result = {
+        'accuracy': None,
+        'correct': None,
+        'dataset': name,
+        'error': None,
+        'load_seconds': None,
+        'seconds': None,
+        'strategy': strategy,
+        'total': None,
+    }
+
+    start = time.time()
+    try:
+        training, test = _load_training_set(name)
+        result['load_seconds'] = time.time() - start
+
+        start = time.time()
+        c = Classifier()
+        c.use_columns(training)
+        labels = c.classify_many(
+            [test.vector(r) for r in range(len(test))], strategy
+        )
+        correct = len([r for r in range(len(test))
+            if test.label(r) == labels[r]])
+    except (ValueError, ZeroDivisionError) as e:
+        result['error'] = '{}: {}'.format(e.__class__.__name__, e)
+        return result
+
+    result['seconds']  = time.time() - start
+    result['correct']  = correct
+    result['total']    = len(test)
+    result['accuracy'] = float(correct) / len(test)
+    return result
 
 # list1 = [54, 72, 78, 49, 65, 63, 75, 67, 54]
 
@@ -1,6 +1,8 @@
 import csv
 import Queue
 
+import metrics
+
 class Clusterer(object):
     def __init__(self):
         self.columns        = []
@@ -29,16 +31,11 @@ class Clusterer(object):
                 self.data[i].append(value)
 
     # Distance methods
-    def euclidean(self, coord1, coord2):
-        x1, y1 = coord1
-        x2, y2 = coord2
-        return pow(pow(x1 - x2, 2) + pow(y1 - y2, 2), 0.5)
+    def euclidean(self, vector1, vector2):
+        return metrics.euclidean(vector1, vector2)
 
     def manhattan(self, vector1, vector2):
-        square_sums = []
-        for i in range(len(vector1)):
-            square_sums.append(pow(vector1[i] - vector2[i], 2))
-        return pow(sum(square_sums), 0.5)
+        return metrics.manhattan(vector1, vector2)
 
     # Normalization methods
     def normalize(self):
@@ -0,0 +1,68 @@
+import random
+
+from math import sqrt
+
+# Pivots come from their own generator, so taking a median doesn't move
+# the global random state that callers may have seeded
+_pivots = random.Random(0)
+
+def select(values, k):
+    """Rearrange values in place so values[k] is the k-th smallest, with
+    nothing larger before it and nothing smaller after it. Expected O(n)."""
+    left  = 0
+    right = len(values) - 1
+    while left < right:
+        pivot = values[_pivots.randint(left, right)]
+        i = left
+        j = right
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            right = j
+        elif k >= i:
+            left = i
+        else:
+            break
+    return values[k]
+
+def median(values):
+    """Median by quickselect on a copy, leaving values untouched."""
+    values = list(values)
+    middle = len(values) // 2
+    right  = select(values, middle)
+    if len(values) % 2 == 0:
+        left = max(values[:middle])
+        return (left + right) / 2
+    else:
+        return right
+
+class ColumnStatistics(object):
+    """Median, absolute standard deviation, mean and standard deviation of
+    one column, each computed once."""
+
+    def __init__(self, values):
+        values = list(values)
+        length = float(len(values))
+
+        self.length  = len(values)
+        self.median  = median(values)
+        self.average = sum(values) / length
+        self.absolute_standard_deviation = (
+            sum([abs(x - self.median) for x in values]) / length
+        )
+        self.standard_deviation = sqrt(
+            sum([pow(x - self.average, 2) for x in values]) / length
+        )
+
+    def modified_standard_score(self, value):
+        return (value - self.median) / self.absolute_standard_deviation
+
+    def standard_score(self, value):
+        return (value - self.average) / self.standard_deviation
@@ -0,0 +1,177 @@
+import json
+import os
+import struct
+
+from array import array
+
+# Header: magic, source mtime and size, number of rows and num columns,
+# byte size of a value, and the byte lengths of the JSON format and label
+# table and of the JSON comments, which are only decoded when used.
+HEADER = struct.Struct('<8sd6q')
+MAGIC  = b'COLUMNS2'
+SUFFIX = '.columns'
+
+COLUMN_TYPES = ['class', 'comment', 'num']
+
+def load_columns(path, typecode='d'):
+    """Columns of a training set file, read from its binary sidecar when
+    the sidecar was written for the file's current mtime and size, and
+    parsed from the text (refreshing the sidecar) otherwise. typecode is
+    'd' for float64 values or 'f' for float32."""
+    stat    = os.stat(path)
+    columns = read_sidecar(path + SUFFIX, stat, typecode)
+    if columns is None:
+        columns = parse_columns(path, typecode)
+        try:
+            write_sidecar(columns, path + SUFFIX, stat)
+        except (IOError, OSError):
+            # A read-only sets directory only costs the cache
+            pass
+    return columns
+
+def parse_columns(path, typecode='d'):
+    """Parse a file whose first line names each column num, class or
+    comment."""
+    columns = Columns(typecode)
+    label_ids = {}
+
+    f = open(path, 'r')
+    columns.format = read_format(f, path)
+    for line in f:
+        if not line.strip():
+            continue
+        label, vector, comment = parse_line(columns.format, line)
+        if label not in label_ids:
+            label_ids[label] = len(columns.labels)
+            columns.labels.append(label)
+        columns.classes.append(label_ids[label])
+        columns.values.extend(vector)
+        columns.comments.append(comment)
+    f.close()
+
+    columns.width = columns.format.count('num')
+    return columns
+
+def parse_line(format, line):
+    """(class, num values, comment fields) of one line."""
+    fields  = [w.strip() for w in line.split(',')]
+    label   = None
+    vector  = []
+    comment = []
+    for i in range(len(fields)):
+        if format[i] == 'num':
+            vector.append(float(fields[i]))
+        elif format[i] == 'comment':
+            comment.append(fields[i])
+        elif format[i] == 'class':
+            label = fields[i]
+    return (label, vector, comment)
+
+def read_chunks(path, chunk_size=10000):
+    """Yield the rows of a training set file as lists of at most
+    chunk_size (class, num values, comment fields) tuples, holding only one
+    chunk in memory."""
+    f = open(path, 'r')
+    format = read_format(f, path)
+    chunk  = []
+    for line in f:
+        if not line.strip():
+            continue
+        chunk.append(parse_line(format, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    f.close()
+    if chunk:
+        yield chunk
+
+def read_format(f, path):
+    """Column types from the first line of an open training set file."""
+    format = [w.strip() for w in f.readline().split(',')]
+    if 'class' not in format or set(format) - set(COLUMN_TYPES):
+        f.close()
+        raise ValueError('{} has no column format line'.format(path))
+    return format
+
+def read_sidecar(path, stat, typecode='d'):
+    """Columns from a sidecar, or None if it is missing or stale."""
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    try:
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            return None
+        (magic, mtime, size, rows, width, itemsize, tables_length,
+            comments_length) = HEADER.unpack(header)
+        if (magic != MAGIC or mtime != stat.st_mtime or
+                size != stat.st_size or itemsize != array(typecode).itemsize):
+            return None
+
+        columns = Columns(typecode)
+        columns.width = width
+        columns.values.fromfile(f, rows * width)
+        columns.classes.fromfile(f, rows)
+        tables   = json.loads(f.read(tables_length).decode('utf-8'))
+        comments = f.read(comments_length)
+        if len(comments) != comments_length:
+            return None
+    except (EOFError, ValueError):
+        return None
+    finally:
+        f.close()
+
+    columns.format = tables['format']
+    columns.labels = tables['labels']
+    columns.comments_blob = comments
+    return columns
+
+def write_sidecar(columns, path, stat):
+    tables = json.dumps({
+        'format': columns.format,
+        'labels': columns.labels,
+    }).encode('utf-8')
+    comments = json.dumps(columns.comments).encode('utf-8')
+
+    f = open(path, 'wb')
+    f.write(HEADER.pack(
+        MAGIC, stat.st_mtime, stat.st_size, len(columns), columns.width,
+        columns.values.itemsize, len(tables), len(comments)
+    ))
+    columns.values.tofile(f)
+    columns.classes.tofile(f)
+    f.write(tables)
+    f.write(comments)
+    f.close()
+
+class Columns(object):
+    """A training set as a row-major matrix of its num columns, the class
+    of each row coded as an index into labels, and each row's comment
+    fields. Comments read from a sidecar stay encoded until first used."""
+
+    def __init__(self, typecode='d'):
+        self.classes  = array('i')
+        self.format   = []
+        self.labels   = []
+        self.values   = array(typecode)
+        self.width    = 0
+        self.comments_blob = None
+        self.__comments    = []
+
+    def __len__(self):
+        return len(self.classes)
+
+    @property
+    def comments(self):
+        if self.comments_blob is not None:
+            self.__comments    = json.loads(self.comments_blob.decode('utf-8'))
+            self.comments_blob = None
+        return self.__comments
+
+    def label(self, row):
+        return self.labels[self.classes[row]]
+
+    def vector(self, row):
+        return list(self.values[row * self.width:(row + 1) * self.width])
@@ -1,16 +1,29 @@
-from math import sqrt
+import metrics
+
+from column_statistics import ColumnStatistics, median
 from recommender import Recommender
 
 class ContentRecommender(Recommender):
     def absolute_standard_deviation(self, values):
         # Uses median instead of average to account for outliers
-        median = self.median(values)
-        num    = sum([abs(x - median) for x in values])
-        return num / float(len(values))
+        return self.column_statistics(values).absolute_standard_deviation
+
+    def approximate_nearest_neighbor(self, key, dict1, k=1):
+        """Like compute_nearest_neighbor, from an index built with
+        build_ann_index(vectors=items)."""
+        return self.ann_index.query(dict1, k, key)
 
     def average(self, values):
         return sum([x for x in values]) / float(len(values))
 
+    def column_statistics(self, values):
+        """Statistics of a column, computed in one go. Pass the result to
+        standard_score or modified_standard_score in place of the values to
+        score a whole column without recomputing them."""
+        if isinstance(values, ColumnStatistics):
+            return values
+        return ColumnStatistics(values)
+
     def classify(self, user, item, dict1, items):
         nearest = self.compute_nearest_neighbor(item, dict1, items)
         return self.data[user][nearest[0][1]]
@@ -31,51 +44,44 @@ class ContentRecommender(Recommender):
         return sorted(array)
 
     def manhattan(self, vector1, vector2):
-        return sum([abs(vector1[i] - vector2[i]) for i in range(len(vector1))])
+        return metrics.manhattan(vector1, vector2)
 
     def median(self, values):
-        values.sort()
-        middle = len(values) / 2
-        if len(values) % 2 == 0:
-            left  = values[middle - 1]
-            right = values[middle]
-            return (left + right) / 2
-        else:
-            return values[middle]
+        if isinstance(values, ColumnStatistics):
+            return values.median
+        return median(values)
 
     def modified_standard_score(self, value, values):
         # Uses median instead of average
-        num = value - self.median(values)
-        return num / self.absolute_standard_deviation(values)
+        return self.column_statistics(values).modified_standard_score(value)
 
     def standard_deviation(self, values):
-        avg = self.average(values)
-        num = sum([pow(x - avg, 2) for x in values])
-        return sqrt(num / float(len(values)))
+        return self.column_statistics(values).standard_deviation
 
     def standard_score(self, value, values):
-        return (value - self.average(values)) / self.standard_deviation(values)
+        return self.column_statistics(values).standard_score(value)
 
-r      = ContentRecommender()
-data   = r.load_data('salary')
-values = data.values()
+if __name__ == '__main__':
+    r      = ContentRecommender()
+    data   = r.load_data('salary')
+    values = data.values()
 
-sd = r.standard_deviation(values)
-ss = r.standard_score(data['Rita A'], values)
-manhattan = r.manhattan([5, 5, 4, 2, 1, 1, 1], [1, 5, 2.5, 1, 1, 5, 1])
-# print(manhattan)
+    sd = r.standard_deviation(values)
+    ss = r.standard_score(data['Rita A'], values)
+    manhattan = r.manhattan([5, 5, 4, 2, 1, 1, 1], [1, 5, 2.5, 1, 1, 5, 1])
+    # print(manhattan)
 
-items = r.load_data('music')
-data  = r.load_data('users_like')
-dict1 = {
-    "piano": 1,
-    "vocals": 5,
-    "beat": 2.5,
-    "blues": 1,
-    "guitar": 1,
-    "backup vocals": 5,
-    "rap": 1
-}
-nearest = r.compute_nearest_neighbor('Cagle', dict1, items)
-classify = r.classify('Angelica', 'Cagle', dict1, items)
-# print(classify)
+    items = r.load_data('music')
+    data  = r.load_data('users_like')
+    dict1 = {
+        "piano": 1,
+        "vocals": 5,
+        "beat": 2.5,
+        "blues": 1,
+        "guitar": 1,
+        "backup vocals": 5,
+        "rap": 1
+    }
+    nearest = r.compute_nearest_neighbor('Cagle', dict1, items)
+    classify = r.classify('Angelica', 'Cagle', dict1, items)
+    # print(classify)
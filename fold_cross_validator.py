@@ -1,15 +1,28 @@
+import multiprocessing
 import random
+import time
 
 from classifier import Classifier
+from fold_index import FoldIndex
+from training_set import TrainingSet
+
+# Write buffer per bucket file while creating buckets
+BUCKET_BUFFER_SIZE = 1024 * 1024
 
 class FoldCrossValidator(Classifier):
-    def __init__(self, name, column_format, number_of_buckets=10):
-        """Initializer"""
+    def __init__(self, name, column_format, number_of_buckets=10,
+            typecode='d'):
+        """Initializer. typecode 'f' keeps the data as float32."""
         super(FoldCrossValidator, self).__init__()
+        self.buckets           = None
+        self.classify_seconds  = None
+        self.compression_ratio = None
         self.confusion_matrix  = {}
         self.column_format     = column_format
+        self.fit_seconds       = None
         self.name              = name
         self.number_of_buckets = number_of_buckets
+        self.typecode          = typecode
 
         self.reset_data()
 
@@ -18,7 +31,60 @@ class FoldCrossValidator(Classifier):
     def __bucket_filename(self, bucket_number):
         return "{}-{}".format(self.name, bucket_number)
 
+    def add_rows(self, rows, training):
+        if training:
+            self.data = rows if not len(self.data) else self.data + rows
+        else:
+            self.test_data = (rows if not len(self.test_data) else
+                self.test_data + rows)
+
+    def fold_index(self):
+        """Every bucket, parsed once on first use and then shared by all
+        the folds. create_buckets throws it away."""
+        if self.buckets is None:
+            index = FoldIndex(self.new_rows())
+            for i in range(self.number_of_buckets):
+                f = self.__open_file(self.__bucket_filename(i), self.name)
+                index.add_bucket(self.parse_lines(f.readlines()))
+                f.close()
+            self.buckets = index
+        return self.buckets
+
     def load_data_from_lines(self, lines, training):
+        rows = self.new_rows()
+        rows.extend(self.parse_lines(lines))
+        self.add_rows(rows, training)
+
+    def load_training_buckets(self, exclude_bucket_number):
+        """Load buckets for training data, excluding a particular bucket."""
+        index = self.fold_index()
+        self.add_rows(
+            index.select(index.training_indices(exclude_bucket_number)), True
+        )
+
+    def load_test_buckets(self, bucket_number):
+        """Load bucket for test data."""
+        index = self.fold_index()
+        self.add_rows(index.select(index.test_indices(bucket_number)), False)
+
+    def merge_confusion_matrix(self, matrix):
+        """Add a fold's confusion matrix into self.confusion_matrix, which
+        stays square over every category either of them has seen."""
+        categories = set(self.confusion_matrix) | set(matrix)
+        for category in categories:
+            row = self.confusion_matrix.setdefault(category, {})
+            for column in categories:
+                row.setdefault(column, 0)
+
+        for category in matrix:
+            for column, count in matrix[category].items():
+                self.confusion_matrix[category][column] += count
+
+    def new_rows(self):
+        return TrainingSet(typecode=self.typecode)
+
+    def parse_lines(self, lines):
+        rows = []
         for line in lines:
             classification = None
             ignore         = []
@@ -36,34 +102,8 @@ class FoldCrossValidator(Classifier):
                     ignore.append(field_value)
 
             if classification:
-                tup = (classification, vector, ignore)
-                if training:
-                    self.data.append(tup)
-                else:
-                    self.test_data.append(tup)
-
-    def load_training_buckets(self, exclude_bucket_number):
-        """Load buckets for training data, excluding a particular bucket."""
-        numbers = range(self.number_of_buckets)
-        slice1  = slice(0, exclude_bucket_number)
-        slice2  = slice(exclude_bucket_number + 1, self.number_of_buckets)
-        bucket_numbers = numbers[slice1] + numbers[slice2]
-
-        lines = []
-        for i in bucket_numbers:
-            f = self.__open_file(self.__bucket_filename(i), self.name)
-            lines += f.readlines()
-            f.close()
-
-        self.load_data_from_lines(lines, True)
-
-    def load_test_buckets(self, bucket_number):
-        """Load bucket for test data."""
-        f = self.__open_file(self.__bucket_filename(bucket_number), self.name)
-        lines = f.readlines()
-        f.close()
-
-        self.load_data_from_lines(lines, False)
+                rows.append((classification, vector, ignore))
+        return rows
 
     def __open_file(self, filename, folder=None):
         if folder:
@@ -110,9 +150,85 @@ class FoldCrossValidator(Classifier):
 
             print('{} |{}'.format(key, line_string))
 
+    def print_grid(self, results):
+        print('{:<12} {:<10} {:>4} {:>9} {:>7} {:>9}'.format(
+            'strategy', 'metric', 'k', 'accuracy', 'kappa', 'time'))
+        for r in results:
+            print('{:<12} {:<10} {:>4} {:>8.2f}% {:>7.3f} {:>8.3f}s'.format(
+                r['strategy'], r['metric'], r['k'], r['accuracy'] * 100,
+                r['kappa'], r['seconds']))
+
     def reset_data(self):
-        self.data      = []
-        self.test_data = []
+        self.data      = self.new_rows()
+        self.test_data = self.new_rows()
+        self.reset_scaling()
+
+    def run_folds(self, method, jobs=1, *args):
+        """The method named method, e.g. 'test_fold', called as
+        method(bucket, *args) for every bucket; the results come back in
+        bucket order. Any jobs other than 1 runs the folds in a pool of that
+        many processes (None for one per CPU), each with its own copy of
+        this validator."""
+        # Parse the buckets before forking so every worker shares them
+        self.fold_index()
+        buckets = range(self.number_of_buckets)
+        if jobs == 1:
+            return [getattr(self, method)(i, *args) for i in buckets]
+
+        pool = multiprocessing.Pool(jobs, _use_validator, (self,))
+        try:
+            return pool.map(_run_fold,
+                [(method, i) + args for i in buckets], 1)
+        finally:
+            pool.terminate()
+
+    def __merge_sweeps(self, sweeps, k):
+        # Make self.confusion_matrix the folds' merged matrices for k and
+        # return the number correct
+        self.confusion_matrix = {}
+        for sweep in sweeps:
+            self.merge_confusion_matrix(sweep['confusion_matrices'][k - 1])
+        return sum([sweep['correct'][k - 1] for sweep in sweeps])
+
+    def __shuffled_buckets(self, generator):
+        # Fisher-Yates on generator.random(), whose sequence for a seed is
+        # the same on Python 2 and 3, unlike random.shuffle's
+        order = list(range(self.number_of_buckets))
+        for i in range(len(order) - 1, 0, -1):
+            j = int(generator.random() * (i + 1))
+            order[i], order[j] = order[j], order[i]
+        return order
+
+    def __sweep(self, k_max):
+        # Confusion matrices and correct counts for k = 1..k_max over the
+        # loaded fold, ranking each test row once
+        all_categories = set(
+            [v[0] for v in self.data] + [v[0] for v in self.test_data]
+        )
+        matrices = []
+        for k in range(k_max):
+            matrices.append({})
+            for cat in all_categories:
+                matrices[k][cat] = dict.fromkeys(all_categories, 0)
+        correct = [0] * k_max
+
+        for value in self.test_data:
+            category  = value[0]
+            neighbors = self.nearest_neighbors(self.transform(value[1]), k_max)
+            winners   = self.votes_by_k([n[1][0] for n in neighbors])
+            # With fewer training rows than k, every row votes
+            winners  += winners[-1:] * (k_max - len(winners))
+
+            for k in range(k_max):
+                matrices[k][category][winners[k]] += 1
+                if category == winners[k]:
+                    correct[k] += 1
+
+        return {
+            'confusion_matrices': matrices,
+            'correct': correct,
+            'tested': len(self.test_data),
+        }
 
     def split_line(self, line):
         array = []
@@ -129,43 +245,144 @@ class FoldCrossValidator(Classifier):
 
         return super(FoldCrossValidator, self).classify(vector, strategy)
 
-    def create_buckets(self, class_column=0):
+    def compare_reduction(self, strategy, reduction='condense', k=None):
+        """Cross validate with the full training buckets and again with
+        them reduced to prototypes (see Classifier.reduce), and report the
+        compression ratio, the change in accuracy and, for both runs, the
+        seconds spent fitting (and reducing) and classifying the test rows.
+        Reducing is paid once per training set, classifying on every
+        query."""
+        results = {}
+        for name, method in [('full', None), ('reduced', reduction)]:
+            self.confusion_matrix = {}
+            results[name] = self.test_training_bucket(strategy, k, method)
+            results[name + '_fit_seconds']      = self.fit_seconds
+            results[name + '_classify_seconds'] = self.classify_seconds
+
+        results['accuracy_delta']    = results['reduced'] - results['full']
+        results['compression_ratio'] = self.compression_ratio
+
+        print('')
+        print('{}: {:.2f}x fewer training rows, accuracy {:+.2f} '
+            'points'.format(reduction, self.compression_ratio,
+                results['accuracy_delta'] * 100))
+        print('classifying took {:.3f}s instead of {:.3f}s'.format(
+            results['reduced_classify_seconds'],
+            results['full_classify_seconds']))
+        print('fitting and reducing took {:.3f}s, fitting alone '
+            '{:.3f}s'.format(results['reduced_fit_seconds'],
+                results['full_fit_seconds']))
+        return results
+
+    def create_buckets(self, class_column=0, seed=None):
         """Seperate the data into X buckets and stratify them so that there is
-        the same amount of representation of each category in each bucket."""
+        the same amount of representation of each category in each bucket.
+
+        The training set is streamed, not read into memory. The n-th line
+        of a category goes to bucket order[n % X], where order is a fresh
+        shuffle of the buckets for every X lines of that category. Each
+        bucket thus gets its share of every category, give or take a line,
+        memory only grows with the number of categories, and the same seed
+        always gives the same buckets."""
+        generator = random.Random(seed)
+        orders    = {}
+        seen      = {}
 
         f = self.__open_file('{}_training_set'.format(self.name))
-        lines = f.readlines()
-        f.close()
-
-        data = {}
-
-        for line in lines:
-            # Get the category
-            category = line.split()[class_column]
-            data.setdefault(category, [])
-            data[category].append(line)
-        # Initialize the buckets
+        self.buckets = None
         buckets = []
-        for i in range(self.number_of_buckets):
-            buckets.append([])
-        # For each category, put the data into the buckets
-        for key in data.keys():
-            # Randomize order of instances for each class
-            random.shuffle(data[key])
-            bucket_number = 0
-            # Divide into buckets
-            for item in data[key]:
-                buckets[bucket_number].append(item)
-                bucket_number = (bucket_number + 1) % self.number_of_buckets
-        # Write to file
-        for bucket_number in range(self.number_of_buckets):
-            f = open('sets/{}/{}'.format(
-                self.name, self.__bucket_filename(bucket_number)
-            ), 'w')
-            for item in buckets[bucket_number]:
-                f.write(item)
+        try:
+            for bucket_number in range(self.number_of_buckets):
+                buckets.append(open('sets/{}/{}'.format(
+                    self.name, self.__bucket_filename(bucket_number)
+                ), 'w', BUCKET_BUFFER_SIZE))
+
+            for line in f:
+                # Get the category
+                category = line.split()[class_column]
+                count    = seen.get(category, 0)
+                if count % self.number_of_buckets == 0:
+                    orders[category] = self.__shuffled_buckets(generator)
+                seen[category] = count + 1
+
+                bucket_number = orders[category][
+                    count % self.number_of_buckets
+                ]
+                buckets[bucket_number].write(line)
+        finally:
+            for bucket in buckets:
+                bucket.close()
             f.close()
 
+    def grid_fold(self, bucket_number, strategies, metrics, k_max):
+        """k_sweep_fold for every strategy and metric, sharing what they
+        have in common: the fold is scaled once per strategy and its test
+        rows ranked once per strategy and metric. Returns the sweeps by
+        (strategy, metric), each with the seconds it took."""
+        print('Testing bucket {}'.format(bucket_number))
+
+        sweeps = {}
+        for strategy in strategies:
+            start = time.time()
+            self.reset_data()
+            self.load_training_buckets(bucket_number)
+            self.load_test_buckets(bucket_number)
+            self.fit(strategy, metrics[0])
+            # Each metric is charged its share of the scaling
+            scaling = (time.time() - start) / len(metrics)
+
+            for metric in metrics:
+                start = time.time()
+                self.use_metric(metric)
+                sweep = self.__sweep(k_max)
+                sweep['seconds'] = scaling + time.time() - start
+                sweeps[(strategy, metric)] = sweep
+
+        return sweeps
+
+    def grid_search(self, strategies=['normalize', 'standardize'],
+            ks=range(1, 11), metrics=['euclidean', 'manhattan'], jobs=1):
+        """Cross validate knn with every strategy, k and metric. Each fold
+        runs grid_fold, in jobs processes as in run_folds, so every k
+        reuses one ranking per strategy and metric.
+
+        Returns one dict per combination, best first, with the accuracy,
+        the number correct out of total, kappa against a random classifier
+        and seconds, the time spent on its strategy and metric, which its
+        ks share."""
+        ks    = sorted(set(ks))
+        folds = self.run_folds('grid_fold', jobs, strategies, metrics, ks[-1])
+
+        confusion_matrix = self.confusion_matrix
+        results = []
+        for strategy in strategies:
+            for metric in metrics:
+                sweeps  = [fold[(strategy, metric)] for fold in folds]
+                seconds = sum([sweep['seconds'] for sweep in sweeps])
+                total   = sum([sweep['tested'] for sweep in sweeps])
+
+                for k in ks:
+                    correct  = self.__merge_sweeps(sweeps, k)
+                    accuracy = float(correct) / total
+                    results.append({
+                        'accuracy': accuracy,
+                        'correct': correct,
+                        'k': k,
+                        'kappa': self.kappa_statistic(
+                            accuracy, self.random_classifier_accuracy()
+                        ),
+                        'metric': metric,
+                        'seconds': seconds,
+                        'strategy': strategy,
+                        'total': total,
+                    })
+        self.confusion_matrix = confusion_matrix
+
+        results.sort(key=lambda r: (-r['accuracy'], -r['kappa'], r['k'],
+            r['strategy'], r['metric']))
+        self.print_grid(results)
+        return results
+
     def kappa_interpretation(self, kappa):
         if kappa < 0.01:
             return 'less than chance performance'
@@ -187,38 +404,33 @@ class FoldCrossValidator(Classifier):
 
     def knn(self, vector, k, strategy):
         vector = self.standardize(vector, strategy)
-        neighbors = self.nearest_neighbors(vector)[slice(0, k)]
-        votes = {}
-        for n in neighbors:
-            values = n[1]
-            category = values[0]
-            votes.setdefault(category, 0)
-            votes[category] += 1
-
-        winning_category = None
-        category_count   = 0
-
-        for k, v in votes.items():
-            if v > category_count:
-                winning_category = k
-                category_count   = v
-
-        return winning_category
+        neighbors = self.nearest_neighbors(vector, k)
+        return self.vote([n[1][0] for n in neighbors])
 
     def load_all_training_buckets(self):
         self.reset_data()
         self.load_training_buckets(self.number_of_buckets)
 
-    def optimal_k(self):
-        array = []
+    def k_sweep_fold(self, bucket_number, strategy, k_max):
+        """Test one fold with every k from 1 to k_max at once. Each test
+        row's k_max nearest training rows are ranked once and every prefix
+        of the ranking votes, giving what knn would for that k. Returns a
+        confusion matrix and the number correct for each k, and the number
+        tested."""
+        print('Testing bucket {}'.format(bucket_number))
 
-        for i in range(50):
-            print('K = {}'.format(i))
+        self.reset_data()
+        self.load_training_buckets(bucket_number)
+        self.load_test_buckets(bucket_number)
+        self.fit(strategy)
 
-            percentage = c.test_training_bucket('normalize', i)
-            array.append((percentage, i))
+        return self.__sweep(k_max)
 
-        return sorted(array, reverse=True)[0][1]
+    def optimal_k(self, strategy='normalize', k_max=50, jobs=1):
+        """k from 1 to k_max with the best cross validated accuracy, the
+        largest one on a tie."""
+        accuracies = self.sweep_k(strategy, k_max, jobs)
+        return max([(accuracies[k], k) for k in accuracies])[1]
 
     def random_classifier_accuracy(self):
         """Calculate the accuracy of a random classifier."""
@@ -243,38 +455,104 @@ class FoldCrossValidator(Classifier):
         total = sum([column_percentage[k] * v for (k, v) in row_totals.items()])
         return total / total_instances
 
-    def test_training_bucket(self, strategy, k=None):
-        correct = 0
+    def sweep_k(self, strategy='normalize', k_max=50, jobs=1):
+        """Cross validated knn accuracy for every k from 1 to k_max, by k,
+        for about the cost of one test_training_bucket run (see
+        k_sweep_fold). The confusion matrices by k are kept in
+        self.k_confusion_matrices."""
+        results = self.run_folds('k_sweep_fold', jobs, strategy, k_max)
+
+        tested = sum([result['tested'] for result in results])
+        confusion_matrix = self.confusion_matrix
+        self.k_confusion_matrices = {}
+        accuracies = {}
+        for k in range(1, k_max + 1):
+            correct = self.__merge_sweeps(results, k)
+            self.k_confusion_matrices[k] = self.confusion_matrix
+            accuracies[k] = float(correct) / tested
+            print('K = {}: {} percent accurate'.format(k, accuracies[k] * 100))
+
+        self.confusion_matrix = confusion_matrix
+        return accuracies
+
+    def test_fold(self, bucket_number, strategy, k=None, reduction=None):
+        """Train on every bucket but one and test that one. Returns the
+        fold's confusion matrix, the number correct out of tested, the
+        seconds spent fitting (and reducing) and classifying and, with
+        reduction, the training rows before and after reducing."""
+        print('Testing bucket {}'.format(bucket_number))
 
-        all_categories = []
-        for i in range(self.number_of_buckets):
-            print('Testing bucket {}'.format(i))
+        self.reset_data()
+        self.load_training_buckets(bucket_number)
+        self.load_test_buckets(bucket_number)
 
-            self.reset_data()
-            self.load_training_buckets(i)
-            self.load_test_buckets(i)
-
-            if len(all_categories) == 0:
-                all_categories = set([v[0] for v in self.data + self.test_data])
-                for cat in all_categories:
-                    self.confusion_matrix.setdefault(
-                        cat, dict.fromkeys(all_categories, 0)
-                    )
-
-            for value in self.test_data:
-                category   = value[0]
-                vector     = value[1]
-                if k:
-                    classified = self.knn(vector, k, strategy)
-                else:
-                    classified = self.classify(vector, strategy)
-
-                self.confusion_matrix[category][classified] += 1
-
-                if category == classified:
-                    correct += 1
-
-        total_length = len(self.data) + len(self.test_data)
+        all_categories = set(
+            [v[0] for v in self.data] + [v[0] for v in self.test_data]
+        )
+        confusion_matrix = {}
+        for cat in all_categories:
+            confusion_matrix[cat] = dict.fromkeys(all_categories, 0)
+
+        result = {
+            'after': 0,
+            'before': 0,
+            'classify_seconds': 0,
+            'confusion_matrix': confusion_matrix,
+            'correct': 0,
+            'fit_seconds': 0,
+            'tested': len(self.test_data),
+        }
+
+        start = time.time()
+        self.fit(strategy)
+        if reduction:
+            result['before'] = len(self.data)
+            self.reduce(reduction)
+            result['after']  = len(self.data)
+        result['fit_seconds'] = time.time() - start
+
+        start = time.time()
+        for value in self.test_data:
+            category   = value[0]
+            vector     = value[1]
+            if k:
+                classified = self.knn(vector, k, strategy)
+            else:
+                classified = self.classify(vector, strategy)
+
+            confusion_matrix[category][classified] += 1
+
+            if category == classified:
+                result['correct'] += 1
+        result['classify_seconds'] = time.time() - start
+
+        return result
+
+    def test_training_bucket(self, strategy, k=None, reduction=None,
+            jobs=1):
+        """Accuracy over every bucket. With reduction, each fold's training
+        rows are fitted and reduced to prototypes before testing. jobs
+        tests the folds in parallel (see run_folds); the folds' results are
+        merged in bucket order, so they match the serial run's."""
+        results = self.run_folds('test_fold', jobs, strategy, k, reduction)
+
+        correct = 0
+        tested  = 0
+        before  = 0
+        after   = 0
+        self.classify_seconds = 0
+        self.fit_seconds      = 0
+        for result in results:
+            self.merge_confusion_matrix(result['confusion_matrix'])
+            correct += result['correct']
+            tested  += result['tested']
+            before  += result['before']
+            after   += result['after']
+            self.classify_seconds += result['classify_seconds']
+            self.fit_seconds      += result['fit_seconds']
+
+        # Every instance is tested once, in its own bucket
+        total_length = tested
         accuracy     = float(correct) / total_length
         percentage   = accuracy * 100
 
@@ -283,9 +561,23 @@ class FoldCrossValidator(Classifier):
         print('')
         print('{} percent accurate'.format(percentage))
         print('total of {} instances'.format(total_length))
+        if reduction:
+            self.compression_ratio = float(before) / max(after, 1)
+            print('{} kept {} of {} training rows ({:.2f}x)'.format(
+                reduction, after, before, self.compression_ratio))
 
         return accuracy
 
+# The validator a pool worker tests folds with
+_validator = None
+
+def _run_fold(args):
+    return getattr(_validator, args[0])(*args[1:])
+
+def _use_validator(validator):
+    global _validator
+    _validator = validator
+
 # c = FoldCrossValidator(
 #     'mpg', ['class', 'num', 'num', 'num', 'num', 'num', 'comment']
 # )
@@ -0,0 +1,39 @@
+from array import array
+
+class FoldIndex(object):
+    """Every bucket of a cross validation run, parsed once.
+
+    rows holds the rows of all the buckets, bucket after bucket, and
+    starts[b]:starts[b + 1] are bucket b's rows, so a fold is just two
+    arrays of row numbers and changing folds reads and parses nothing.
+    rows can be a TrainingSet or a plain list."""
+
+    def __init__(self, rows=None):
+        self.rows   = [] if rows is None else rows
+        self.starts = array('l', [0])
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def add_bucket(self, rows):
+        self.rows.extend(rows)
+        self.starts.append(len(self.rows))
+
+    def select(self, indices):
+        """Copy of the rows at indices, of the same type as rows."""
+        if hasattr(self.rows, 'subset'):
+            return self.rows.subset(indices)
+        return [self.rows[i] for i in indices]
+
+    def test_indices(self, bucket_number):
+        return array('l', range(self.starts[bucket_number],
+            self.starts[bucket_number + 1]))
+
+    def training_indices(self, exclude_bucket_number):
+        """Row numbers of every bucket but one, in bucket order. Passing
+        len(self) or more excludes nothing."""
+        indices = array('l')
+        for bucket_number in range(len(self)):
+            if bucket_number != exclude_bucket_number:
+                indices.extend(self.test_indices(bucket_number))
+        return indices
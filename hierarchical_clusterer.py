@@ -80,18 +80,11 @@ class HierarchicalClusterer(Clusterer):
             self.distances[i] = {}
             for index in indices:
                 if i != index:
-                    if len(self.data[1:]) == 2:
-                        coord1 = (self.data[1][i], self.data[2][i])
-                        coord2 = (self.data[1][index], self.data[2][index])
-                        self.distances[i][index] = self.euclidean(
-                            coord1, coord2
-                        )
-                    else:
-                        vector1 = [x[i] for x in self.data[1:]]
-                        vector2 = [x[index] for x in self.data[1:]]
-                        self.distances[i][index] = self.manhattan(
-                            vector1, vector2
-                        )
+                    vector1 = [x[i] for x in self.data[1:]]
+                    vector2 = [x[index] for x in self.data[1:]]
+                    self.distances[i][index] = self.euclidean(
+                        vector1, vector2
+                    )
 
     def nearest_neighbor(self, dictionary):
         return sorted([(v, k) for k, v in dictionary.items()])[0]
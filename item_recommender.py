@@ -1,8 +1,23 @@
+import heapq
+
 from math import sqrt
+from rating_matrix import random_rating_changes
 from recommender import Recommender
 
 class ItemRecommender(Recommender):
+    def __init__(self, data=None):
+        super(ItemRecommender, self).__init__(data)
+        self.deviations   = None
+        self.frequencies  = None
+        self.similarities = None
+        self.similarity_sums = None
+        self.top_n        = None
+
     def average_deviations(self, key1, key2):
+        if self.deviations is not None:
+            return (float(self.deviations[key1][key2]) /
+                self.frequencies[key1][key2])
+
         array = []
         for (key, value) in self.data.items():
             if key1 in value and key2 in value:
@@ -11,8 +26,29 @@ class ItemRecommender(Recommender):
                 array.append(i - j)
         return float(sum(array)) / len(array)
 
+    def cardinality(self, key1, key2):
+        """Number of users who rated both items."""
+        if self.frequencies is not None:
+            return self.frequencies.get(key1, {}).get(key2, 0)
+        return len([v for v in self.data.values() if key1 in v and key2 in v])
+
+    def bump_versions(self, user, item):
+        # The user's average rating moves, which changes the adjusted cosine
+        # similarity and deviations of every item they rated
+        super(ItemRecommender, self).bump_versions(user, item)
+        for key in self.data.get(user, {}):
+            if key != item:
+                self.versions[('item', key)] = (
+                    self.versions.get(('item', key), 0) + 1
+                )
+
     # Adjusted cosine similarity
     def cosine_similarity(self, key1, key2):
+        return self.memoize(('cosine_similarity', key1, key2),
+            [('item', key1), ('item', key2)],
+            lambda: self.__cosine_similarity(key1, key2))
+
+    def __cosine_similarity(self, key1, key2):
         sum_x_y = 0
         sum_x_2 = 0
         sum_y_2 = 0
@@ -30,42 +66,320 @@ class ItemRecommender(Recommender):
         den = sqrt(sum_x_2) * sqrt(sum_y_2)
         return sum_x_y / den
 
+    def clear_indexes(self):
+        super(ItemRecommender, self).clear_indexes()
+        self.deviations   = None
+        self.frequencies  = None
+        self.similarities = None
+        self.similarity_sums = None
+
+    def compute_deviations(self):
+        """Sum of rating differences and number of co-ratings for every
+        pair of items, in one pass over the users. set_rating and
+        delete_rating keep both up to date afterwards."""
+        self.deviations  = {}
+        self.frequencies = {}
+        # Cached slope one predictions were made without these
+        self.epoch += 1
+        for ratings in self.data.values():
+            for (key1, rating1) in ratings.items():
+                deviations  = self.deviations.setdefault(key1, {})
+                frequencies = self.frequencies.setdefault(key1, {})
+                for (key2, rating2) in ratings.items():
+                    if key1 != key2:
+                        deviations.setdefault(key2, 0)
+                        deviations[key2] += rating1 - rating2
+                        frequencies.setdefault(key2, 0)
+                        frequencies[key2] += 1
+        return self.deviations
+
+    def delete_rating(self, user, item):
+        self.check_writable()
+        if self.deviations is not None and item in self.data[user]:
+            self.__update_deviations(user, item, self.data[user][item], -1)
+        old = self.__take_back_similarities(user)
+        super(ItemRecommender, self).delete_rating(user, item)
+        self.__put_back_similarities(user, old)
+
     def denormalize(self, value, min_r, max_r):
         return (0.5 * ((value + 1) * (max_r - min_r))) + min_r
 
+    def fit(self, top_n=None):
+        """Compute the adjusted cosine similarity of every pair of items
+        rated by a common user in one pass over the users, averaging each
+        user's ratings once. With top_n only the top_n most similar items
+        are kept for each item. predict and predict_all read from it.
+
+        The sums behind each similarity are kept in similarity_sums, as
+        {item: {item: [sum_x_y, sum_x_2, sum_y_2, n]}}, so set_rating and
+        delete_rating can take back a user's old contributions and add
+        the new ones instead of fitting again."""
+        self.top_n = top_n
+        # Cached predictions were made from other similarities
+        self.epoch += 1
+
+        self.similarity_sums = {}
+        for value in self.data.values():
+            self.__add_similarity_sums(value, 1)
+
+        self.similarities = {}
+        for key in self.similarity_sums:
+            self.__rescore(key)
+        return self.similarities
+
     def normalize(self, value, min_r, max_r):
         num = (2 * (value - min_r)) - (max_r - min_r)
         den = max_r - min_r
         return float(num) / float(den)
 
     def predict(self, user, item, min_r=1, max_r=5):
+        """Similarity-weighted average of the user's normalized ratings.
+        Items whose similarity to item is undefined, because nobody rated
+        both or their adjusted ratings are all zero, are skipped, fitted or
+        not. Raises ZeroDivisionError when none are left."""
+        return self.memoize(('predict', user, item, min_r, max_r),
+            self.__dependencies(user, item),
+            lambda: self.__predict(user, item, min_r, max_r))
+
+    def __predict(self, user, item, min_r, max_r):
         sum_num = 0
         sum_den = 0
         for key in self.data[user]:
             if key != item:
-                similarity = self.cosine_similarity(key, item)
+                if self.similarities is None:
+                    try:
+                        similarity = self.cosine_similarity(key, item)
+                    except ZeroDivisionError:
+                        continue
+                elif key in self.similarities.get(item, {}):
+                    similarity = self.similarities[item][key]
+                else:
+                    continue
                 sum_num += (similarity *
                     self.normalize(self.data[user][key], min_r, max_r))
                 sum_den += abs(similarity)
         return float(sum_num) / float(sum_den)
 
+    def predict_all(self, user, min_r=1, max_r=5):
+        """Predict every item the user hasn't rated that is similar to one
+        they have, best first. Needs fit()."""
+        if self.similarities is None:
+            raise ValueError('Call fit() before predict_all')
+
+        array = []
+        for item in self.similarities:
+            if item not in self.data[user]:
+                row = self.similarities[item]
+                if any([key in row for key in self.data[user]]):
+                    prediction = self.predict(user, item, min_r, max_r)
+                    array.append((item, prediction))
+        return sorted(array,
+            key=lambda data_tuple: data_tuple[1], reverse = True)
+
+    def set_rating(self, user, item, rating):
+        self.check_writable()
+        if self.deviations is not None:
+            if item in self.data.get(user, {}):
+                self.__update_deviations(user, item,
+                    self.data[user][item], -1)
+            self.__update_deviations(user, item, rating, 1)
+        old = self.__take_back_similarities(user)
+        super(ItemRecommender, self).set_rating(user, item, rating)
+        self.__put_back_similarities(user, old)
+
+    def slope_one_all(self, u):
+        """Weighted slope one prediction of every item the user hasn't
+        rated, best first, from the deviations of compute_deviations."""
+        if self.deviations is None:
+            raise ValueError('Call compute_deviations() before slope_one_all')
+
+        num = {}
+        den = {}
+        for (i, u_i) in self.data[u].items():
+            for (j, card_j_i) in self.frequencies.get(i, {}).items():
+                if j not in self.data[u]:
+                    num.setdefault(j, 0)
+                    den.setdefault(j, 0)
+                    num[j] += self.deviations[j][i] + u_i * card_j_i
+                    den[j] += card_j_i
+        array = [(j, float(num[j]) / den[j]) for j in num]
+        return sorted(array,
+            key=lambda data_tuple: data_tuple[1], reverse = True)
+
     def weighted_slope_one(self, u, j):
+        return self.memoize(('weighted_slope_one', u, j),
+            self.__dependencies(u, j),
+            lambda: self.__weighted_slope_one(u, j))
+
+    def __weighted_slope_one(self, u, j):
         num = 0
         den = 0
         for i in self.data[u]:
             if i != j:
+                card_j_i = self.cardinality(j, i)
+                if card_j_i == 0:
+                    continue
                 dev_j_i = self.average_deviations(j, i)
                 u_i = self.data[u][i]
-                card_j_i = len([key for key in self.data[u] if key != j])
                 num += (dev_j_i + u_i) * card_j_i
                 den += card_j_i
-        return num / den
+        return float(num) / den
+
+    # Private methods
+
+    def __dependencies(self, user, item):
+        # A prediction reads the user's row and the item's similarity to or
+        # deviation from each item in it
+        return ([('user', user), ('item', item)] +
+            [('item', key) for key in self.data[user]])
+
+    def __add_similarity_sums(self, ratings, sign):
+        # Add (sign 1) or take back (sign -1) one user's mean-adjusted
+        # contributions to the sums of every pair of items they rated
+        if not ratings:
+            return
+        array   = [float(v) for (k, v) in ratings.items()]
+        average = sum(array) / len(array)
+        adjusted = [(k, v - average) for (k, v) in ratings.items()]
+        for (key1, x_adjusted) in adjusted:
+            for (key2, y_adjusted) in adjusted:
+                if key1 < key2:
+                    row  = self.similarity_sums.setdefault(key1, {})
+                    pair = row.get(key2)
+                    if pair is None:
+                        # Shared by both items; x is always key1's
+                        pair = row[key2] = [0, 0, 0, 0]
+                        self.similarity_sums.setdefault(key2, {})[key1] = pair
+                    pair[0] += sign * x_adjusted * y_adjusted
+                    pair[1] += sign * pow(x_adjusted, 2)
+                    pair[2] += sign * pow(y_adjusted, 2)
+                    pair[3] += sign
+                    if pair[3] == 0:
+                        del self.similarity_sums[key1][key2]
+                        del self.similarity_sums[key2][key1]
+
+    def __put_back_similarities(self, user, old):
+        # Add the user's new contributions and rescore the pairs of items
+        # either row holds; no other pair changed. A top_n row is rebuilt,
+        # since items outside it may now make the cut
+        if old is None:
+            return
+        new = self.data.get(user, {})
+        self.__add_similarity_sums(new, 1)
+        keys = set(old) | set(new)
+        for key1 in keys:
+            if self.top_n is not None:
+                self.__rescore(key1)
+                continue
+            row = self.similarities.setdefault(key1, {})
+            for key2 in keys:
+                if key1 != key2:
+                    similarity = self.__similarity(key1, key2)
+                    if similarity is None:
+                        row.pop(key2, None)
+                    else:
+                        row[key2] = similarity
+            if not row:
+                del self.similarities[key1]
+
+    def __rescore(self, key):
+        # Rebuild one item's row of similarities from its sums
+        row = {}
+        for other in self.similarity_sums.get(key, {}):
+            similarity = self.__similarity(key, other)
+            if similarity is not None:
+                row[other] = similarity
+        if self.top_n is not None:
+            row = dict(heapq.nlargest(self.top_n, row.items(),
+                key=lambda data_tuple: data_tuple[1]))
+        if row:
+            self.similarities[key] = row
+        else:
+            self.similarities.pop(key, None)
+
+    def __similarity(self, key1, key2):
+        # From the fitted sums; None when nobody rated both or the adjusted
+        # ratings are all zero
+        pair = self.similarity_sums.get(key1, {}).get(key2)
+        if pair is None:
+            return None
+        sum_x_y, sum_x_2, sum_y_2, n = pair
+        den = sqrt(sum_x_2) * sqrt(sum_y_2)
+        if not den:
+            return None
+        return sum_x_y / den
+
+    def __take_back_similarities(self, user):
+        # Before a rating change: take the user's contributions out of the
+        # fitted sums and return the row they came from
+        if self.similarity_sums is None:
+            return None
+        old = dict(self.data.get(user, {}))
+        self.__add_similarity_sums(old, -1)
+        return old
+
+    def __update_deviations(self, user, item, rating, sign):
+        # Add (sign 1) or take back (sign -1) one rating's contribution
+        for (key, value) in self.data.get(user, {}).items():
+            if key == item:
+                continue
+            for (key1, key2, difference) in [(item, key, rating - value),
+                    (key, item, value - rating)]:
+                deviations  = self.deviations.setdefault(key1, {})
+                frequencies = self.frequencies.setdefault(key1, {})
+                deviations[key2]  = deviations.get(key2, 0) + sign * difference
+                frequencies[key2] = frequencies.get(key2, 0) + sign
+                if frequencies[key2] == 0:
+                    del deviations[key2]
+                    del frequencies[key2]
+
+def unit_test():
+    # The similarity sums and slope one tables set_rating and delete_rating
+    # update in place must match fit and compute_deviations from scratch
+    def close(x, y):
+        return abs(x - y) < 1e-9
+
+    online = ItemRecommender()
+    online.fit()
+    online.compute_deviations()
+    for user, item, rating in random_rating_changes():
+        if rating is None:
+            if user in online.data:
+                online.delete_rating(user, item)
+        else:
+            online.set_rating(user, item, rating)
+
+    rebuilt = ItemRecommender(online.data)
+    rebuilt.fit()
+    rebuilt.compute_deviations()
+    rows1 = dict((k, v) for (k, v) in online.similarity_sums.items() if v)
+    rows2 = dict((k, v) for (k, v) in rebuilt.similarity_sums.items() if v)
+    assert(sorted(rows1) == sorted(rows2))
+    for key1 in rows1:
+        assert(sorted(rows1[key1]) == sorted(rows2[key1]))
+        for key2 in rows1[key1]:
+            assert(all([close(x, y) for (x, y) in
+                zip(rows1[key1][key2], rows2[key1][key2])]))
+    for matrix in ['deviations', 'frequencies']:
+        rows1 = getattr(online, matrix)
+        rows2 = getattr(rebuilt, matrix)
+        assert(dict((k, v) for (k, v) in rows1.items() if v) ==
+            dict((k, v) for (k, v) in rows2.items() if v))
+
+    # weighted_slope_one reads the same tables slope_one_all does
+    for user in online.data:
+        for (item, prediction) in online.slope_one_all(user):
+            assert(close(online.weighted_slope_one(user, item), prediction))
+    print('online similarities and deviations work correctly')
+
+# unit_test()
 
-item = ItemRecommender()
-data = item.load_data('users')
+if __name__ == '__main__':
+    item = ItemRecommender()
+    data = item.load_data('users')
 
-cosine = item.cosine_similarity("Kacey Musgraves", "Imagine Dragons")
-predict = item.predict("David", "Kacey Musgraves")
-average_deviations = item.average_deviations("Whitney Houston", "PSY")
-weighted_slope_one = item.weighted_slope_one("Ben", "Whitney Houston")
-print(weighted_slope_one)
+    cosine = item.cosine_similarity("Kacey Musgraves", "Imagine Dragons")
+    predict = item.predict("David", "Kacey Musgraves")
+    average_deviations = item.average_deviations("Whitney Houston", "PSY")
+    weighted_slope_one = item.weighted_slope_one("Ben", "Whitney Houston")
+    print(weighted_slope_one)
@@ -175,10 +175,7 @@ class KmeansClusterer(Clusterer):
 
     # Distance methods
     def distance(self, vector1, vector2):
-        if len(vector1) == 2:
-            return self.euclidean(vector1, vector2)
-        else:
-            return self.manhattan(vector1, vector2)
+        return self.euclidean(vector1, vector2)
 
 def dogs():
     c = KmeansClusterer(4)
@@ -0,0 +1,80 @@
+import collections
+import itertools
+import time
+
+_namespaces = itertools.count()
+
+def new_namespace():
+    """A key prefix no other cache user has, so several recommenders can
+    share one cache without seeing each other's entries."""
+    return next(_namespaces)
+
+class LRUCache(object):
+    """Bounded least recently used cache with optional time to live.
+
+    Every entry is stored with the versions of what it was computed from;
+    a lookup with different versions, or after ttl seconds, is a miss and
+    drops the entry."""
+
+    def __init__(self, max_size=10000, ttl=None, clock=time.time):
+        self.clock    = clock
+        self.entries  = collections.OrderedDict()
+        self.max_size = max_size
+        self.ttl      = ttl
+
+        self.evictions     = 0
+        self.expirations   = 0
+        self.hits          = 0
+        self.invalidations = 0
+        self.misses        = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get(self, key, versions=()):
+        """Return (True, value) on a hit and (False, None) on a miss."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return (False, None)
+
+        expires, entry_versions, value = entry
+        if expires is not None and self.clock() >= expires:
+            self.expirations += 1
+            self.misses += 1
+            return (False, None)
+        if entry_versions != versions:
+            self.invalidations += 1
+            self.misses += 1
+            return (False, None)
+
+        # Re-inserting moves the entry to the most recently used end
+        self.entries[key] = entry
+        self.hits += 1
+        return (True, value)
+
+    def put(self, key, value, versions=()):
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+
+        self.entries.pop(key, None)
+        self.entries[key] = (expires, versions, value)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'hits': self.hits,
+            'invalidations': self.invalidations,
+            'misses': self.misses,
+            'size': len(self.entries),
+        }
@@ -0,0 +1,124 @@
+import functools
+
+from math import sqrt
+
+# Larger scores are nearer for these; for every other metric smaller is
+SIMILARITIES = ['cosine_similarity', 'pearson']
+
+def common(dict1, dict2):
+    """Values of the keys two dicts share, as two aligned lists in the
+    order of the first dict, so the scalar kernels work on ratings."""
+    keys = [key for key in dict1 if key in dict2]
+    return ([dict1[key] for key in keys], [dict2[key] for key in keys])
+
+# Scalar kernels over two vectors of the same length
+
+def cosine_similarity(vector1, vector2):
+    similarity = cosine_from_sums(*cosine_sums(vector1, vector2))
+    if similarity is None:
+        raise ZeroDivisionError('Cosine similarity of a zero vector')
+    return similarity
+
+def euclidean(vector1, vector2):
+    return pow(sum([pow(v1 - v2, 2) for (v1, v2) in zip(vector1, vector2)]),
+        0.5)
+
+def manhattan(vector1, vector2):
+    return sum([abs(v1 - v2) for (v1, v2) in zip(vector1, vector2)])
+
+def minkowski(vector1, vector2, r=5):
+    return minkowski_from_sum(
+        sum([pow(abs(v1 - v2), r) for (v1, v2) in zip(vector1, vector2)]), r
+    )
+
+def pearson(vector1, vector2):
+    correlation = pearson_from_sums(*pearson_sums(vector1, vector2))
+    if correlation is None:
+        raise ZeroDivisionError('Pearson correlation of a constant vector')
+    return correlation
+
+# Running sums, and the finishers that turn them into a score. Sparse
+# one-vs-all code accumulates the same sums item by item and finishes
+# them here.
+
+def cosine_sums(vector1, vector2):
+    sum_x_y = 0
+    sum_x_2 = 0
+    sum_y_2 = 0
+    for x, y in zip(vector1, vector2):
+        sum_x_y += x * y
+        sum_x_2 += pow(x, 2)
+        sum_y_2 += pow(y, 2)
+    return (sum_x_y, sum_x_2, sum_y_2)
+
+def cosine_from_sums(sum_x_y, sum_x_2, sum_y_2):
+    """None when either vector is all zeros."""
+    den = sqrt(sum_x_2) * sqrt(sum_y_2)
+    if not den:
+        return None
+    return sum_x_y / den
+
+def minkowski_from_sum(total, r=5):
+    if total > 0:
+        return pow(total, 1.0 / r)
+    else:
+        return 0
+
+def pearson_sums(vector1, vector2):
+    n = 0
+    sum_x = 0
+    sum_y = 0
+    sum_x_y = 0
+    sum_x_2 = 0
+    sum_y_2 = 0
+    for x, y in zip(vector1, vector2):
+        n += 1
+        sum_x += x
+        sum_y += y
+        sum_x_y += x * y
+        sum_x_2 += pow(x, 2)
+        sum_y_2 += pow(y, 2)
+    return (n, sum_x, sum_y, sum_x_y, sum_x_2, sum_y_2)
+
+def pearson_from_sums(n, sum_x, sum_y, sum_x_y, sum_x_2, sum_y_2):
+    """None when there is nothing to correlate or either side is
+    constant. Rounding can leave a variance a hair below zero, which is
+    taken as zero."""
+    if not n:
+        return None
+    n = float(n)
+    num = sum_x_y - (sum_x * sum_y / n)
+    den = (sqrt(max(sum_x_2 - (pow(sum_x, 2) / n), 0)) *
+        sqrt(max(sum_y_2 - (pow(sum_y, 2) / n), 0)))
+    if not den:
+        return None
+    return num / den
+
+# One-vs-many and many-vs-many kernels
+
+METRICS = {
+    'cosine_similarity': cosine_similarity,
+    'euclidean': euclidean,
+    'manhattan': manhattan,
+    'minkowski': minkowski,
+    'pearson': pearson,
+}
+
+def kernel(metric, r=5):
+    """Scalar kernel for a metric name, with r bound for minkowski."""
+    if metric not in METRICS:
+        raise ValueError('Unknown metric: {}'.format(metric))
+    if metric == 'minkowski':
+        return functools.partial(minkowski, r=r)
+    return METRICS[metric]
+
+def one_vs_many(vector, matrix, metric='euclidean', r=5):
+    """Score of vector against every row of matrix."""
+    score = kernel(metric, r)
+    return [score(vector, row) for row in matrix]
+
+def many_vs_many(matrix1, matrix2, metric='euclidean', r=5):
+    """Table of scores, one row per row of matrix1 and one column per row
+    of matrix2."""
+    score = kernel(metric, r)
+    return [[score(vector, row) for row in matrix2] for vector in matrix1]
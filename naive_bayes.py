@@ -32,7 +32,21 @@ class NaiveBayes(FoldCrossValidator):
 
         return max(hypotheses)[1]
 
-    def load_data_from_lines(self, lines, training):
+    def add_rows(self, rows, training):
+        for classification, dict1, vector in rows:
+            if training:
+                self.data.setdefault(classification, {})
+                for key in dict1:
+                    self.data[classification].setdefault(key, [])
+                    self.data[classification][key].append(dict1[key])
+            else:
+                self.test_data.append((classification, vector))
+
+    def new_rows(self):
+        return []
+
+    def parse_lines(self, lines):
+        rows = []
         for line in lines:
             classification = None
             dict1          = {}
@@ -54,13 +68,8 @@ class NaiveBayes(FoldCrossValidator):
                     vector.append(value)
 
             if classification:
-                if training:
-                    self.data.setdefault(classification, {})
-                    for key in dict1:
-                        self.data[classification].setdefault(key, [])
-                        self.data[classification][key].append(dict1[key])
-                else:
-                    self.test_data.append((classification, vector))
+                rows.append((classification, dict1, vector))
+        return rows
 
     def calculate_means_and_sample_standard_deviation(self):
         """Store all the means and sample standard deviations for use when
@@ -159,30 +168,49 @@ class NaiveBayes(FoldCrossValidator):
         self.test_means                      = {}
         self.test_sample_standard_deviations = {}
 
-    def test_training_bucket(self):
-        correct = 0
+    def test_fold(self, bucket_number):
+        print('Testing bucket {}'.format(bucket_number))
+
+        self.reset_data()
 
-        for i in range(self.number_of_buckets):
-            print('Testing bucket {}'.format(i))
+        self.load_training_buckets(bucket_number)
+        self.load_test_buckets(bucket_number)
 
-            self.reset_data()
+        self.calculate_means_and_sample_standard_deviation()
 
-            self.load_training_buckets(i)
-            self.load_test_buckets(i)
+        confusion_matrix = {}
+        correct          = 0
+        for value in self.test_data:
+            cat    = value[0]
+            vector = value[1]
 
-            self.calculate_means_and_sample_standard_deviation()
+            classified = self.probability_density_function(vector)
+            confusion_matrix.setdefault(cat, {})
+            confusion_matrix[cat].setdefault(classified, 0)
+            confusion_matrix[cat][classified] += 1
 
-            for value in self.test_data:
-                cat    = value[0]
-                vector = value[1]
+            if cat == classified:
+                correct += 1
 
-                classified = self.probability_density_function(vector)
+        return {
+            'confusion_matrix': confusion_matrix,
+            'correct': correct,
+            'tested': len(self.test_data),
+        }
+
+    def test_training_bucket(self, jobs=1):
+        """Accuracy over every bucket, testing the folds in jobs processes
+        as in FoldCrossValidator.test_training_bucket."""
+        correct = 0
+        tested  = 0
 
-                if cat == classified:
-                    correct += 1
+        for result in self.run_folds('test_fold', jobs):
+            self.merge_confusion_matrix(result['confusion_matrix'])
+            correct += result['correct']
+            tested  += result['tested']
 
-        length = sum([len(v.items()[0][1]) for (k, v) in self.data.items()])
-        total_length = length + len(self.test_data)
+        # Every instance is tested once, in its own bucket
+        total_length = tested
         accuracy     = float(correct) / total_length
         percentage   = accuracy * 100
 
@@ -0,0 +1,61 @@
+from spatial_index import DISTANCES, build_index
+
+def condense(points, labels, metric='euclidean'):
+    """Hart's condensed nearest neighbor. Starting from the first point,
+    pass over the rest adding every point the kept ones misclassify by
+    1-NN, until a pass adds nothing. Returns the kept indices, sorted; they
+    classify every point correctly, with ties between equally distant
+    points going to the lower index as in Classifier."""
+    if not points:
+        return []
+    distance = DISTANCES[metric]
+
+    kept    = [0]
+    kept_in = set(kept)
+    # Each point's nearest kept point so far, and how many of the kept
+    # points that covers, so later passes only look at new additions
+    nearest = [None] * len(points)
+    checked = [0] * len(points)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(points)):
+            if i in kept_in:
+                continue
+            for j in kept[checked[i]:]:
+                candidate = (distance(points[i], points[j]), j)
+                if nearest[i] is None or candidate < nearest[i]:
+                    nearest[i] = candidate
+            checked[i] = len(kept)
+            if labels[nearest[i][1]] != labels[i]:
+                kept.append(i)
+                kept_in.add(i)
+                changed = True
+    return sorted(kept)
+
+def edit(points, labels, k=3, metric='euclidean', vote=None):
+    """Wilson editing: drop every point its k nearest other points would
+    misclassify, which removes noise and smooths class borders. vote picks
+    a category from the neighbors' labels, nearest first; by default the
+    most common one, ties going to the nearest. Returns the kept indices."""
+    if vote is None:
+        vote = _majority
+    index = build_index(points, metric)
+
+    kept = []
+    for i in range(len(points)):
+        neighbors = [j for (d, j) in index.query(points[i], k + 1) if j != i]
+        if vote([labels[j] for j in neighbors[:k]]) == labels[i]:
+            kept.append(i)
+    return kept
+
+def _majority(categories):
+    counts = {}
+    for category in categories:
+        counts[category] = counts.get(category, 0) + 1
+    if not counts:
+        return None
+    best = max(counts.values())
+    for category in categories:
+        if counts[category] == best:
+            return category
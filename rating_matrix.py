@@ -0,0 +1,282 @@
+import random
+
+from array import array
+from bisect import bisect_left
+
+from metrics import cosine_from_sums, minkowski_from_sum, pearson_from_sums
+
+class RatingMatrix(object):
+    """Sparse user x item rating matrix with interned user and item ids.
+
+    Rows are stored CSR style (indptr, indices, values) in the order each
+    user's ratings were inserted, and the same ratings are stored a second
+    time by column so one user can be scored against every other user in a
+    single pass over the items that user has rated.
+
+    The one-vs-all metrics only score the users who share a rated item with
+    the user. Anyone else is at distance 0, which is what the dict metrics
+    give over no items, and is left out rather than listed."""
+
+    def __init__(self):
+        self.items    = []
+        self.item_ids = {}
+        self.users    = []
+        self.user_ids = {}
+
+        self.indptr  = array('l', [0])
+        self.indices = array('i')
+        self.values  = array('d')
+
+        self.col_indptr  = array('l', [0])
+        self.col_indices = array('i')
+        self.col_values  = array('d')
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build the matrix from a {user: {item: rating}} dictionary."""
+        matrix = cls()
+        for user in data:
+            matrix.user_ids[user] = len(matrix.users)
+            matrix.users.append(user)
+            for item, rating in data[user].items():
+                if item not in matrix.item_ids:
+                    matrix.item_ids[item] = len(matrix.items)
+                    matrix.items.append(item)
+                matrix.indices.append(matrix.item_ids[item])
+                matrix.values.append(rating)
+            matrix.indptr.append(len(matrix.indices))
+        matrix.build_columns()
+        return matrix
+
+    def build_columns(self):
+        """Transpose the rows into the item -> (user, rating) columns."""
+        counts = [0] * (len(self.items) + 1)
+        for item in self.indices:
+            counts[item + 1] += 1
+        for i in range(len(self.items)):
+            counts[i + 1] += counts[i]
+
+        self.col_indptr  = array('l', counts)
+        self.col_indices = array('i', [0]) * len(self.indices)
+        self.col_values  = array('d', [0.0]) * len(self.indices)
+
+        position = list(counts[:-1])
+        for u in range(len(self.users)):
+            for p in range(self.indptr[u], self.indptr[u + 1]):
+                item = self.indices[p]
+                q    = position[item]
+                self.col_indices[q] = u
+                self.col_values[q]  = self.values[p]
+                position[item] += 1
+
+    def co_ratings(self, user):
+        """Yield (other user id, x, y) for every item rated by both users.
+
+        Pairs come out in the order of the user's own ratings, which is the
+        order the dict-based metrics add them up in, so sums match exactly."""
+        u = self.user_ids[user]
+        for p in range(self.indptr[u], self.indptr[u + 1]):
+            item = self.indices[p]
+            x    = self.values[p]
+            for q in range(self.col_indptr[item], self.col_indptr[item + 1]):
+                v = self.col_indices[q]
+                if v != u:
+                    yield (v, x, self.col_values[q])
+
+    def columns(self, user):
+        """Yield (x, users, ratings) for every item the user rated: their
+        rating of it and the item's column, the user included, as two
+        aligned arrays. Lets the distances below run over whole columns
+        instead of one co-rating at a time."""
+        u = self.user_ids[user]
+        for p in range(self.indptr[u], self.indptr[u + 1]):
+            item = self.indices[p]
+            start, end = self.col_indptr[item], self.col_indptr[item + 1]
+            yield (self.values[p], self.col_indices[start:end],
+                self.col_values[start:end])
+
+    def remove_rating(self, user, item):
+        """Delete one rating in place. The user and item keep their ids."""
+        if user not in self.user_ids or item not in self.item_ids:
+            return
+        u = self.user_ids[user]
+        i = self.item_ids[item]
+        p = self.__row_position(u, i)
+        if p is None:
+            return
+
+        del self.indices[p]
+        del self.values[p]
+        self.__shift(self.indptr, u + 1, -1)
+
+        q = self.__column_position(u, i)
+        del self.col_indices[q]
+        del self.col_values[q]
+        self.__shift(self.col_indptr, i + 1, -1)
+
+    def row(self, user):
+        """Return a user's ratings as an {item: rating} dictionary."""
+        u = self.user_ids[user]
+        return dict(
+            (self.items[self.indices[p]], self.values[p])
+            for p in range(self.indptr[u], self.indptr[u + 1])
+        )
+
+    def set_rating(self, user, item, rating):
+        """Add or change one rating in place, leaving the matrix as
+        from_dict would build it from the updated dictionary: a new rating
+        goes at the end of the user's row, and columns stay in user order."""
+        if user not in self.user_ids:
+            self.user_ids[user] = len(self.users)
+            self.users.append(user)
+            self.indptr.append(self.indptr[-1])
+        if item not in self.item_ids:
+            self.item_ids[item] = len(self.items)
+            self.items.append(item)
+            self.col_indptr.append(self.col_indptr[-1])
+        u = self.user_ids[user]
+        i = self.item_ids[item]
+
+        q = self.__column_position(u, i)
+        p = self.__row_position(u, i)
+        if p is not None:
+            self.values[p]     = rating
+            self.col_values[q] = rating
+            return
+
+        p = self.indptr[u + 1]
+        self.indices.insert(p, i)
+        self.values.insert(p, rating)
+        self.__shift(self.indptr, u + 1, 1)
+
+        self.col_indices.insert(q, u)
+        self.col_values.insert(q, rating)
+        self.__shift(self.col_indptr, i + 1, 1)
+
+    # One-vs-all metrics
+
+    def cosine_similarity(self, user):
+        sums = {}
+        for v, x, y in self.co_ratings(user):
+            if v not in sums:
+                sums[v] = [0, 0, 0]
+            s = sums[v]
+            s[0] += x * y
+            s[1] += pow(x, 2)
+            s[2] += pow(y, 2)
+
+        return self.__finish(sums, cosine_from_sums)
+
+    def euclidean(self, user):
+        return self.minkowski(user, 2)
+
+    def manhattan(self, user):
+        totals = {}
+        get    = totals.get
+        for x, users, ratings in self.columns(user):
+            for v, y in zip(users, ratings):
+                totals[v] = get(v, 0) + abs(x - y)
+        return self.__by_name(user, totals)
+
+    def minkowski(self, user, r=5):
+        totals = {}
+        get    = totals.get
+        for x, users, ratings in self.columns(user):
+            for v, y in zip(users, ratings):
+                totals[v] = get(v, 0) + pow(abs(x - y), r)
+        for v in totals:
+            totals[v] = minkowski_from_sum(totals[v], r)
+        return self.__by_name(user, totals)
+
+    def pearson(self, user):
+        sums = {}
+        for v, x, y in self.co_ratings(user):
+            if v not in sums:
+                sums[v] = [0, 0, 0, 0, 0, 0]
+            s = sums[v]
+            s[0] += 1
+            s[1] += x
+            s[2] += y
+            s[3] += x * y
+            s[4] += pow(x, 2)
+            s[5] += pow(y, 2)
+
+        return self.__finish(sums, pearson_from_sums)
+
+    def __by_name(self, user, totals):
+        # totals came from columns, which include the user's own ratings
+        totals.pop(self.user_ids[user], None)
+        return dict((self.users[v], total) for (v, total) in totals.items())
+
+    def __column_position(self, u, i):
+        # Where user u is, or would go, in item i's column
+        return bisect_left(self.col_indices, u,
+            self.col_indptr[i], self.col_indptr[i + 1])
+
+    def __finish(self, sums, finisher):
+        # Users the score is undefined for are left out
+        scores = {}
+        for v, s in sums.items():
+            score = finisher(*s)
+            if score is not None:
+                scores[self.users[v]] = score
+        return scores
+
+    def __row_position(self, u, i):
+        # Position of item i in user u's row, or None
+        for p in range(self.indptr[u], self.indptr[u + 1]):
+            if self.indices[p] == i:
+                return p
+        return None
+
+    def __shift(self, pointers, start, delta):
+        for j in range(start, len(pointers)):
+            pointers[j] += delta
+
+def random_rating_changes(steps=2000, users=30, items=20, seed=0):
+    """Yield the same random (user, item, rating) changes for a seed, a
+    rating of None meaning the rating is deleted. The unit tests drive
+    the incrementally updated structures with them."""
+    generator = random.Random(seed)
+    for step in range(steps):
+        user = 'user{}'.format(generator.randrange(users))
+        item = 'item{}'.format(generator.randrange(items))
+        if generator.random() < 0.3:
+            yield (user, item, None)
+        else:
+            yield (user, item, generator.randint(1, 5))
+
+def unit_test():
+    # Through random set/remove sequences the rows and their column copy
+    # must hold the same ratings, each column sorted by user
+    data   = {}
+    matrix = RatingMatrix()
+    for user, item, rating in random_rating_changes():
+        if rating is None:
+            data.get(user, {}).pop(item, None)
+            matrix.remove_rating(user, item)
+        else:
+            data.setdefault(user, {})[item] = rating
+            matrix.set_rating(user, item, rating)
+
+    assert(matrix.indptr[-1] == len(matrix.indices) == len(matrix.values))
+    assert(matrix.col_indptr[-1] == len(matrix.col_indices) ==
+        len(matrix.col_values))
+    rows = []
+    for u, user in enumerate(matrix.users):
+        start, end = matrix.indptr[u], matrix.indptr[u + 1]
+        assert(len(set(matrix.indices[start:end])) == end - start)
+        assert(matrix.row(user) == data.get(user, {}))
+        rows.extend((matrix.indices[p], u, matrix.values[p])
+            for p in range(start, end))
+    columns = []
+    for i in range(len(matrix.items)):
+        start, end = matrix.col_indptr[i], matrix.col_indptr[i + 1]
+        column = list(zip(matrix.col_indices[start:end],
+            matrix.col_values[start:end]))
+        assert(column == sorted(column))
+        columns.extend((i, v, y) for (v, y) in column)
+    assert(sorted(rows) == columns)
+    print('set_rating and remove_rating work correctly')
+
+# unit_test()
@@ -0,0 +1,278 @@
+import csv
+import json
+import mmap
+import struct
+
+from array import array
+
+from rating_matrix import RatingMatrix
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Header: magic, number of users, items and ratings, byte sizes of the
+# 'l', 'i' and 'd' array items, and the byte lengths of the two name tables.
+HEADER = struct.Struct('<8s8q')
+MAGIC  = b'RATINGS1'
+
+def build_matrix(triplets):
+    """Build a RatingMatrix from (user, item, rating) triplets in one pass.
+
+    Ids are interned as the triplets stream in and only three flat typed
+    arrays are kept, which are then counting-sorted into rows. A repeated
+    (user, item) keeps its first position and its last rating, like
+    assigning into a dict."""
+    matrix  = RatingMatrix()
+    counts  = array('l')
+    users   = array('i')
+    items   = array('i')
+    ratings = array('d')
+
+    for user, item, rating in triplets:
+        u = matrix.user_ids.get(user)
+        if u is None:
+            u = matrix.user_ids[user] = len(matrix.users)
+            matrix.users.append(user)
+            counts.append(0)
+        i = matrix.item_ids.get(item)
+        if i is None:
+            i = matrix.item_ids[item] = len(matrix.items)
+            matrix.items.append(item)
+        users.append(u)
+        items.append(i)
+        ratings.append(float(rating))
+        counts[u] += 1
+
+    indptr = array('l', [0])
+    for count in counts:
+        indptr.append(indptr[-1] + count)
+
+    indices  = array('i', [0]) * len(users)
+    values   = array('d', [0.0]) * len(users)
+    position = array('l', indptr[:-1])
+    for p in range(len(users)):
+        q = position[users[p]]
+        indices[q] = items[p]
+        values[q]  = ratings[p]
+        position[users[p]] += 1
+    del users, items, ratings
+
+    # Drop repeated items, compacting the rows in place
+    w   = 0
+    end = 0
+    for u in range(len(counts)):
+        # indptr[u] was already moved back to where the compacted row
+        # starts, so the original start is the previous row's end
+        start, end = end, indptr[u + 1]
+        seen = {}
+        for p in range(start, end):
+            item = indices[p]
+            if item in seen:
+                values[seen[item]] = values[p]
+            else:
+                seen[item] = w
+                indices[w] = item
+                values[w]  = values[p]
+                w += 1
+        indptr[u + 1] = w
+    del indices[w:]
+    del values[w:]
+
+    matrix.indptr  = indptr
+    matrix.indices = indices
+    matrix.values  = values
+    matrix.build_columns()
+    return matrix
+
+def open_matrix(path):
+    """Memory-map a store written by save_matrix. Nothing is parsed; names
+    are decoded the first time they are looked up."""
+    return StoredRatingMatrix(path)
+
+def read_csv(path):
+    """Yield (user, item, rating) from user,item,rating lines, skipping a
+    header line if there is one."""
+    f = open(path, 'r')
+    for line_number, row in enumerate(csv.reader(f)):
+        if len(row) < 3:
+            continue
+        try:
+            rating = float(row[2])
+        except ValueError:
+            if line_number == 0:
+                continue
+            raise
+        yield (row[0].strip(), row[1].strip(), rating)
+    f.close()
+
+def read_json_lines(path):
+    """Yield (user, item, rating) from one JSON object per line, either
+    {"user": ..., "item": ..., "rating": ...} or {user: {item: rating}}."""
+    f = open(path, 'r')
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if 'rating' in record:
+            yield (record['user'], record['item'], record['rating'])
+        else:
+            for user, ratings in record.items():
+                for item, rating in ratings.items():
+                    yield (user, item, rating)
+    f.close()
+
+def save_matrix(matrix, path):
+    """Write the matrix arrays and name tables to a binary store."""
+    users = _name_table(matrix.users)
+    items = _name_table(matrix.items)
+
+    f = open(path, 'wb')
+    f.write(HEADER.pack(
+        MAGIC, len(matrix.users), len(matrix.items), len(matrix.values),
+        array('l').itemsize, array('i').itemsize, array('d').itemsize,
+        len(users), len(items)
+    ))
+    for a in [matrix.indptr, matrix.indices, matrix.values,
+            matrix.col_indptr, matrix.col_indices, matrix.col_values]:
+        a = array(getattr(a, 'typecode', None) or a.format, a)
+        a.tofile(f)
+        f.write(b'\0' * _padding(len(a) * a.itemsize))
+    f.write(users)
+    f.write(items)
+    f.close()
+
+def _name_table(names):
+    for name in names:
+        if '\n' in name:
+            raise ValueError('Names cannot contain newlines: {!r}'.format(name))
+    return '\n'.join(names).encode('utf-8')
+
+def _padding(length):
+    # Every array starts on an 8 byte boundary
+    return -length % 8
+
+class RatingRows(Mapping):
+    """Read-only {user: {item: rating}} view over a RatingMatrix, so code
+    written against Recommender.data works on a memory-mapped store.
+
+    Each lookup builds the row as a dict, so the last one is kept for code
+    that looks up the same user again and again. Callers get a copy of it,
+    so changing a row never changes what the view hands out next."""
+
+    def __init__(self, matrix):
+        self.last   = (None, None)
+        self.matrix = matrix
+
+    def __contains__(self, user):
+        return user in self.matrix.user_ids
+
+    def __getitem__(self, user):
+        if self.last[0] != user:
+            if user not in self.matrix.user_ids:
+                raise KeyError(user)
+            self.last = (user, self.matrix.row(user))
+        return dict(self.last[1])
+
+    def __iter__(self):
+        return iter(self.matrix.users)
+
+    def __len__(self):
+        return len(self.matrix.users)
+
+class StoredRatingMatrix(RatingMatrix):
+    """RatingMatrix whose arrays are views into a memory-mapped store."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self.mmap, 0)
+        (magic, n_users, n_items, nnz, l_size, i_size, d_size,
+            users_length, items_length) = header
+        if magic != MAGIC:
+            raise ValueError('{} is not a rating store'.format(path))
+        if (l_size, i_size, d_size) != (array('l').itemsize,
+                array('i').itemsize, array('d').itemsize):
+            raise ValueError('{} was written on another platform'.format(path))
+
+        self.offset = HEADER.size
+        self.indptr      = self.__view('l', n_users + 1)
+        self.indices     = self.__view('i', nnz)
+        self.values      = self.__view('d', nnz)
+        self.col_indptr  = self.__view('l', n_items + 1)
+        self.col_indices = self.__view('i', nnz)
+        self.col_values  = self.__view('d', nnz)
+
+        self.__users_blob = (self.offset, users_length)
+        self.__items_blob = (self.offset + users_length, items_length)
+        self.__names = {}
+
+    @property
+    def items(self):
+        return self.__table('items', self.__items_blob)[0]
+
+    @property
+    def item_ids(self):
+        return self.__table('items', self.__items_blob)[1]
+
+    @property
+    def users(self):
+        return self.__table('users', self.__users_blob)[0]
+
+    @property
+    def user_ids(self):
+        return self.__table('users', self.__users_blob)[1]
+
+    def close(self):
+        for name in ['indptr', 'indices', 'values',
+                'col_indptr', 'col_indices', 'col_values']:
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                view.release()
+        self.mmap.close()
+        self.file.close()
+
+    # Private methods
+
+    def __table(self, name, blob):
+        if name not in self.__names:
+            start, length = blob
+            names = []
+            if length:
+                names = self.mmap[start:start + length].decode('utf-8')
+                names = names.split('\n')
+            ids = dict((names[i], i) for i in range(len(names)))
+            self.__names[name] = (names, ids)
+        return self.__names[name]
+
+    def __view(self, typecode, length):
+        start = self.offset
+        end   = start + length * array(typecode).itemsize
+        self.offset = end + _padding(end - start)
+        try:
+            return memoryview(self.mmap)[start:end].cast(typecode)
+        except (AttributeError, TypeError):
+            # Python 2 has no memoryview.cast, so copy into an array
+            a = array(typecode)
+            a.fromstring(self.mmap[start:end])
+            return a
+
+def unit_test():
+    # A repeated (user, item) keeps its last rating and doesn't spill into
+    # the rows after it
+    triplets = [('a', 'x', 1), ('a', 'x', 2), ('b', 'y', 3),
+        ('c', 'x', 4), ('a', 'z', 5), ('c', 'x', 1), ('c', 'y', 2)]
+    data = {}
+    for user, item, rating in triplets:
+        data.setdefault(user, {})[item] = float(rating)
+    matrix  = build_matrix(triplets)
+    rebuilt = RatingMatrix.from_dict(data)
+    for user in data:
+        assert(matrix.row(user) == data[user])
+        assert(matrix.manhattan(user) == rebuilt.manhattan(user))
+    print('build_matrix works correctly')
+
+# unit_test()
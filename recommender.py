@@ -1,43 +1,149 @@
+import functools
+import heapq
 import json
+import multiprocessing
+import os
+import tempfile
 
-from math import sqrt
+import metrics
+
+from ann_index import RandomHyperplaneLSH, VantagePointTree
+from memo_cache import LRUCache, new_namespace
+from rating_matrix import RatingMatrix, random_rating_changes
+from rating_store import (RatingRows, StoredRatingMatrix, build_matrix,
+    open_matrix, read_csv, read_json_lines, save_matrix)
+from similarity_index import SimilarityIndex
 
 class Recommender(object):
-    def __init__(self, data={}):
-        self.data = data
+    def __init__(self, data=None):
+        self.cache = None
+        self.epoch = 0
+        self.data  = {} if data is None else data
+
+    @property
+    def data(self):
+        return self.__data
+
+    @data.setter
+    def data(self, data):
+        # New ratings: drop the matrix, the indexes and anything cached
+        self.__data = data
+        self.clear_indexes()
+
+    def ann_score(self, metric, r=5):
+        """Dict-based metric used by the LSH index."""
+        if metric == 'minkowski':
+            return functools.partial(Recommender.minkowski, self, r=r)
+        return functools.partial(getattr(Recommender, metric), self)
+
+    def approximate_nearest_neighbor(self, key, k=1):
+        """k nearest users from the index built by build_ann_index."""
+        return self.ann_index.query(self.data[key], k, key)
+
+    def build_ann_index(self, metric='manhattan', vectors=None, r=5,
+            **options):
+        """Build an approximate nearest neighbor index over self.data, or
+        over other {key: {attribute: value}} vectors such as item attributes.
+        Cosine similarity and pearson get random hyperplane LSH (options
+        n_bits, n_tables) scored with the dict metrics. Distances get a
+        vantage point tree (epsilon), which needs every vector to have the
+        same attributes, so it is for item attributes rather than ratings;
+        nearest_users is the fast exact search over ratings."""
+        if vectors is None:
+            vectors = self.data
+        if metric in ['cosine_similarity', 'pearson']:
+            self.ann_index = RandomHyperplaneLSH(vectors,
+                self.ann_score(metric, r), metric, **options)
+        else:
+            self.ann_index = VantagePointTree(vectors,
+                metrics.kernel(metric, r), **options)
+        return self.ann_index
+
+    def build_similarity_index(self):
+        """Keep per-pair co-rating statistics so ratings can be changed with
+        set_rating/delete_rating without rescoring every pair."""
+        self.similarity_index = SimilarityIndex(self.data)
+        return self.similarity_index
+
+    def build_store(self, source, file_name):
+        """Stream ratings from a user,item,rating CSV file or a JSON lines
+        file into a binary store at file_name, then open it."""
+        if source.endswith('.csv'):
+            triplets = read_csv(source)
+        else:
+            triplets = read_json_lines(source)
+        save_matrix(build_matrix(triplets), file_name)
+        return self.load_store(file_name)
+
+    def bump_versions(self, user, item):
+        """Invalidate cached results that depend on this user or item."""
+        for key in [('user', user), ('item', item)]:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def check_writable(self):
+        """Raise before a rating change if self.data is a store view."""
+        if isinstance(self.matrix, StoredRatingMatrix):
+            raise ValueError('Ratings loaded with load_store are read-only; '
+                'load them with load_data to change them')
+
+    def clear_indexes(self):
+        self.ann_index = None
+        self.matrix    = None
+        self.similarity_index = None
+        # New data: nothing cached before this point applies any more
+        self.epoch   += 1
+        self.versions = {}
 
     def compute_nearest_neighbor(self, key):
-        array = []
-        for k in self.data:
-            if k != key:
-                total = self.manhattan(self.data[key], self.data[k])
-                array.append((total, k))
-        array.sort()
         #=> [(2.0, 'James'), (3.5, 'Kim')]
-        return array
+        return self.nearest_users(key)
 
     def cosine_similarity(self, list1, list2):
-        sum_x_y = 0
-        sum_x_2 = 0
-        sum_y_2 = 0
-        for key in list1:
-            if key in list2:
-                x = list1[key]
-                y = list2[key]
-                sum_x_y += x * y
-                sum_x_2 += pow(x, 2)
-                sum_y_2 += pow(y, 2)
-        den = sqrt(sum_x_2) * sqrt(sum_y_2)
-        return sum_x_y / den
+        return metrics.cosine_similarity(*metrics.common(list1, list2))
+
+    def cosine_similarity_all(self, key):
+        return self.rating_matrix().cosine_similarity(key)
+
+    def delete_rating(self, user, item):
+        self.check_writable()
+        if item in self.data[user]:
+            del self.data[user][item]
+            if self.matrix is not None:
+                self.matrix.remove_rating(user, item)
+            self.bump_versions(user, item)
+            if self.similarity_index is not None:
+                self.similarity_index.remove_rating(user, item)
+
+    def enable_cache(self, max_size=10000, ttl=None, cache=None):
+        """Memoize similarity and prediction calls. Pass the same cache to
+        several recommenders to share it."""
+        if cache is None:
+            cache = LRUCache(max_size, ttl)
+        self.cache = cache
+        self.cache_namespace = new_namespace()
+        return self.cache
 
     def euclidean(self, list1, list2):
         return self.minkowski(list1, list2, 2)
 
+    def euclidean_all(self, key):
+        """Euclidean distance from one user to every user they share a
+        rated item with. Anyone else is at distance 0 and left out."""
+        return self.rating_matrix().euclidean(key)
+
     def load_data(self, file_name):
         f = open('{}.json'.format(file_name), 'r')
         self.data = json.loads(f.read())
         return self.data
 
+    def load_store(self, file_name):
+        """Memory-map a store written by build_store. self.data becomes a
+        read-only view of it."""
+        matrix      = open_matrix(file_name)
+        self.data   = RatingRows(matrix)
+        self.matrix = matrix
+        return self.data
+
     def load_text(self, file_name, columns):
         self.data = {}
         f = open('{}.txt'.format(file_name), 'r')
@@ -51,68 +157,250 @@ class Recommender(object):
         return self.data
 
     def manhattan(self, list1, list2):
-        total = 0
-        for key in list1:
-            if key in list2:
-                total += abs(list1[key] - list2[key])
         #=> 2.0
-        return total
+        return metrics.manhattan(*metrics.common(list1, list2))
+
+    def manhattan_all(self, key):
+        """Manhattan distance from one user to every user they share a
+        rated item with. Anyone else is at distance 0 and left out."""
+        return self.rating_matrix().manhattan(key)
+
+    def memoize(self, key, dependencies, compute):
+        """Return compute(), cached under key until the version of any of
+        the ('user', name) or ('item', name) dependencies changes."""
+        if self.cache is None:
+            return compute()
+
+        key = (self.cache_namespace, self.epoch) + key
+        versions = tuple([self.versions.get(d, 0) for d in dependencies])
+        found, value = self.cache.get(key, versions)
+        if not found:
+            value = compute()
+            self.cache.put(key, value, versions)
+        return value
 
     def minkowski(self, list1, list2, r=5):
-        total = 0
-        for key in list1:
-            if key in list2:
-                total += pow(abs(list1[key] - list2[key]), r)
-        if total > 0:
-            return pow(total, 1.0 / r)
-        else:
-            return 0
+        return metrics.minkowski(*metrics.common(list1, list2), r=r)
+
+    def minkowski_all(self, key, r=5):
+        """Minkowski distance from one user to every user they share a
+        rated item with. Anyone else is at distance 0 and left out."""
+        return self.rating_matrix().minkowski(key, r)
+
+    def nearest_users(self, key, k=None):
+        """(manhattan distance, user) for the k users nearest to key, or
+        all of them, nearest first. Only users who share a rated item with
+        key are considered; with a similarity index this is a lookup,
+        without one a pass over the rating matrix."""
+        if self.similarity_index is not None:
+            return self.similarity_index.nearest_neighbors(
+                key, 'manhattan', k
+            )
+
+        distances = self.manhattan_all(key)
+        array = [(total, other) for (other, total) in distances.items()]
+        if k is None:
+            return sorted(array)
+        return heapq.nsmallest(k, array)
 
     def pearson(self, list1, list2):
-        n = 0
-        sum_x = 0
-        sum_y = 0
-        sum_x_y = 0
-        sum_x_2 = 0
-        sum_y_2 = 0
-        for key in list1:
-            if key in list2:
-                x = list1[key]
-                y = list2[key]
-                n += 1
-                sum_x += x
-                sum_y += y
-                sum_x_y += x * y
-                sum_x_2 += pow(x, 2)
-                sum_y_2 += pow(y, 2)
-        num = sum_x_y - (sum_x * sum_y / n)
-        den = (sqrt(sum_x_2 - (pow(sum_x, 2) / n)) *
-            sqrt(sum_y_2 - (pow(sum_y, 2) / n)))
-        return num / den
-
-    def recommend(self, key):
-        nearest_neighbor = self.compute_nearest_neighbor(key)[0]
-        neighbor = nearest_neighbor[1]
+        return metrics.pearson(*metrics.common(list1, list2))
+
+    def pearson_all(self, key):
+        """Pearson correlation of one user with every user they share a
+        rated item with. Users the correlation is undefined for are left
+        out."""
+        return self.rating_matrix().pearson(key)
+
+    def rating_matrix(self):
+        """Sparse matrix of self.data, built on first use and updated in
+        place by set_rating and delete_rating. Assigning self.data drops it;
+        change ratings in place only through set_rating and delete_rating."""
+        if self.matrix is None:
+            self.matrix = RatingMatrix.from_dict(self.data)
+        return self.matrix
+
+    def recommend(self, key, k_neighbors=None, n_items=None):
+        """Recommend items the user hasn't rated. By default they come from
+        the single nearest neighbor; with k_neighbors the ratings of the k
+        nearest users are averaged, weighted by 1 / (1 + distance).
+        Neighbors come from nearest_users."""
+        if k_neighbors is None:
+            return self.recommend_from_nearest(key, n_items)
+
+        nearest = self.nearest_users(key, k_neighbors)
+
+        weights      = [(1.0 / (1 + total), k) for (total, k) in nearest]
+        total_weight = sum([weight for (weight, k) in weights])
+
+        rated  = self.data[key]
+        scores = {}
+        for weight, neighbor in weights:
+            for k, rating in self.data[neighbor].items():
+                if k not in rated:
+                    scores.setdefault(k, 0)
+                    scores[k] += rating * weight / total_weight
+
+        array = list(scores.items())
+        if n_items is None:
+            n_items = len(array)
+        #=> [('Phoenix', 4.2), ('Norah Jones', 3.9)]
+        return heapq.nlargest(n_items, array,
+            key=lambda data_tuple: data_tuple[1])
+
+    def recommend_many(self, users, jobs=1, k_neighbors=None,
+            n_items=None, chunksize=64):
+        """Yield (user, recommendations) for every user, in order.
+
+        Any jobs other than 1 splits the users across that many worker
+        processes, None meaning one per CPU. Workers memory-map the rating
+        store instead of receiving a pickled copy of the data; a
+        recommender that wasn't opened with load_store writes a temporary
+        store first. Workers find neighbors by scanning the store, not
+        through a similarity index, which nearest_users answers the same
+        way, so the results don't depend on jobs."""
+        if jobs == 1:
+            for user in users:
+                yield (user, self.recommend(user, k_neighbors, n_items))
+            return
+
+        matrix = self.rating_matrix()
+        temporary = None
+        if isinstance(matrix, StoredRatingMatrix):
+            file_name = matrix.path
+        else:
+            handle, temporary = tempfile.mkstemp(suffix='.store')
+            os.close(handle)
+            save_matrix(matrix, temporary)
+            file_name = temporary
+
+        pool = multiprocessing.Pool(jobs, _open_store,
+            (self.__class__, file_name))
+        try:
+            for result in pool.imap(_recommend_in_worker,
+                    ((user, k_neighbors, n_items) for user in users),
+                    chunksize):
+                yield result
+        finally:
+            pool.terminate()
+            if temporary:
+                os.remove(temporary)
+
+    def recommend_from_nearest(self, key, n_items=None):
+        nearest = self.nearest_users(key, 1)
+        if not nearest:
+            return []
+        rated   = self.data[key]
+        ratings = self.data[nearest[0][1]]
         array = []
-        for k in self.data[neighbor]:
-            if k not in self.data[key]:
-                array.append((k, self.data[neighbor][k]))
+        for k in ratings:
+            if k not in rated:
+                array.append((k, ratings[k]))
         #=> [('Em', 4.0), ('Drake', 5.0)]
-        return sorted(array,
+        array = sorted(array,
             key=lambda data_tuple: data_tuple[1], reverse = True)
+        return array[slice(0, n_items)]
+
+    def set_rating(self, user, item, rating):
+        self.check_writable()
+        self.data.setdefault(user, {})[item] = rating
+        if self.matrix is not None:
+            self.matrix.set_rating(user, item, rating)
+        self.bump_versions(user, item)
+        if self.similarity_index is not None:
+            self.similarity_index.add_rating(user, item, rating)
+
+    def similarity(self, key1, key2, metric='pearson'):
+        """Score two users by name with one of the dict-based metrics,
+        memoized when a cache is enabled."""
+        return self.memoize((metric, key1, key2),
+            [('user', key1), ('user', key2)],
+            lambda: getattr(self, metric)(self.data[key1], self.data[key2]))
+
+def _open_store(cls, file_name):
+    # Runs once in each recommend_many worker process
+    global _worker
+    _worker = cls()
+    _worker.load_store(file_name)
+
+def _recommend_in_worker(args):
+    user, k_neighbors, n_items = args
+    return (user, _worker.recommend(user, k_neighbors, n_items))
+
+def unit_test():
+    # A cached similarity is dropped once either user's ratings change,
+    # and is reused until then
+    plain  = Recommender()
+    cached = Recommender()
+    cached.enable_cache()
+    cached.build_similarity_index()
+    for user, item, rating in random_rating_changes(600, 60, 30):
+        if rating is None:
+            if user not in plain.data:
+                continue
+            plain.delete_rating(user, item)
+            cached.delete_rating(user, item)
+        else:
+            plain.set_rating(user, item, rating)
+            cached.set_rating(user, item, rating)
+        for other in plain.data:
+            for (key1, key2) in [(user, other), (other, user)]:
+                assert(cached.similarity(key1, key2, 'manhattan') ==
+                    plain.similarity(key1, key2, 'manhattan'))
+    assert(cached.cache.hits and cached.cache.invalidations)
+    for user in plain.data:
+        assert(cached.nearest_users(user) == plain.nearest_users(user))
+    print('cached similarities work correctly')
+
+    # Assigning self.data starts a new epoch, so nothing cached or built
+    # from the old ratings is used
+    epoch   = cached.epoch
+    hits    = cached.cache.hits
+    doubled = Recommender(dict((user, dict((item, 2 * rating)
+        for (item, rating) in ratings.items()))
+        for (user, ratings) in plain.data.items()))
+    cached.data = dict(doubled.data)
+    assert(cached.epoch > epoch)
+    assert(cached.similarity_index is None and cached.matrix is None)
+    first = min(doubled.data)
+    for user in doubled.data:
+        assert(cached.compute_nearest_neighbor(user) ==
+            doubled.compute_nearest_neighbor(user))
+        assert(cached.similarity(user, first, 'manhattan') ==
+            doubled.similarity(user, first, 'manhattan'))
+    assert(cached.cache.hits == hits)
+    print('assigning data works correctly')
+
+    # Workers scan the store even when the parent has an index. Items tied
+    # on score may come out in another order on Python 2, whose dicts
+    # don't keep the order the store rows do
+    def ranked(results):
+        return [(user, sorted(array,
+            key=lambda data_tuple: (-data_tuple[1], data_tuple[0])))
+            for (user, array) in results]
+    indexed = Recommender(plain.data)
+    indexed.build_similarity_index()
+    users = sorted(indexed.data)
+    assert(ranked(indexed.recommend_many(users, 1, 3, 5)) ==
+        ranked(indexed.recommend_many(users, 2, 3, 5)))
+    assert(ranked(indexed.recommend_many(users)) ==
+        ranked(indexed.recommend_many(users, 2)))
+    print('recommend_many works correctly')
 
+# unit_test()
 
-recommender = Recommender()
-data = recommender.load_data('users')
+if __name__ == '__main__':
+    recommender = Recommender()
+    data = recommender.load_data('users')
 
-manhattan = recommender.manhattan(data['Jordyn'], data['Hailey'])
-euclidean = recommender.euclidean(data['Jordyn'], data['Hailey'])
-minkowski = recommender.minkowski(data['Jordyn'], data['Hailey'], 2)
-pearson = recommender.pearson(data['Angelica'], data['Jordyn'])
-cosine = recommender.cosine_similarity(data['Clara'], data['Robert'])
-# print(cosine)
+    manhattan = recommender.manhattan(data['Jordyn'], data['Hailey'])
+    euclidean = recommender.euclidean(data['Jordyn'], data['Hailey'])
+    minkowski = recommender.minkowski(data['Jordyn'], data['Hailey'], 2)
+    pearson = recommender.pearson(data['Angelica'], data['Jordyn'])
+    cosine = recommender.cosine_similarity(data['Clara'], data['Robert'])
+    # print(cosine)
 
-data = recommender.load_data('music')
-euclidean = recommender.euclidean(data["Glee Cast/Jessie's Girl"],
-    data["Lady Gaga/Alejandro"])
-# print(euclidean)
+    data = recommender.load_data('music')
+    euclidean = recommender.euclidean(data["Glee Cast/Jessie's Girl"],
+        data["Lady Gaga/Alejandro"])
+    # print(euclidean)
@@ -0,0 +1,153 @@
+import heapq
+
+from math import sqrt
+
+from metrics import cosine_from_sums, pearson_from_sums
+from rating_matrix import random_rating_changes
+
+DISTANCES    = ['euclidean', 'manhattan']
+SIMILARITIES = ['cosine_similarity', 'pearson']
+
+class SimilarityIndex(object):
+    """User-user similarity index kept up to date one rating at a time.
+
+    For every two users who rated at least one common item it stores the
+    sufficient statistics of their co-ratings:
+
+        [n, sum_x, sum_y, sum_x_y, sum_x_2, sum_y_2, sum_abs_x_y]
+
+    where x is the rating of the user that sorts first. Adding, changing or
+    deleting a rating only touches the pairs formed with the other users who
+    rated the same item."""
+
+    def __init__(self, data=None):
+        self.pairs    = {}
+        self.partners = {}
+        self.raters   = {}
+
+        if data:
+            for user in data:
+                for item, rating in data[user].items():
+                    self.add_rating(user, item, rating)
+
+    def add_rating(self, user, item, rating):
+        """Add a rating, replacing the user's previous rating of the item."""
+        raters = self.raters.setdefault(item, {})
+        if user in raters:
+            self.__update(user, item, raters[user], -1)
+        raters[user] = rating
+        self.__update(user, item, rating, 1)
+
+    def remove_rating(self, user, item):
+        raters = self.raters.get(item, {})
+        if user in raters:
+            self.__update(user, item, raters[user], -1)
+            del raters[user]
+
+    def nearest_neighbors(self, user, metric='pearson', k=None):
+        """(score, user) for every user sharing an item with this one, best
+        first: smallest distance or largest similarity."""
+        array = []
+        for other in self.partners.get(user, ()):
+            score = self.similarity(user, other, metric)
+            if score is not None:
+                array.append((score, other))
+
+        if k is None:
+            k = len(array)
+        if metric in DISTANCES:
+            return heapq.nsmallest(k, array)
+        return heapq.nlargest(k, array)
+
+    def similarity(self, user1, user2, metric='pearson'):
+        """Score two users from their stored statistics. Returns None when the
+        users share no items or the metric is undefined for them."""
+        stats = self.pairs.get(self.__key(user1, user2))
+        if stats is None:
+            return None
+        n, sum_x, sum_y, sum_x_y, sum_x_2, sum_y_2, sum_abs_x_y = stats
+
+        if metric == 'manhattan':
+            return sum_abs_x_y
+        elif metric == 'euclidean':
+            return sqrt(max(sum_x_2 - 2 * sum_x_y + sum_y_2, 0))
+        elif metric == 'cosine_similarity':
+            return cosine_from_sums(sum_x_y, sum_x_2, sum_y_2)
+        elif metric == 'pearson':
+            return pearson_from_sums(
+                n, sum_x, sum_y, sum_x_y, sum_x_2, sum_y_2
+            )
+        else:
+            raise ValueError('Unknown metric: {}'.format(metric))
+
+    # Private methods
+
+    def __key(self, user1, user2):
+        if user1 < user2:
+            return (user1, user2)
+        return (user2, user1)
+
+    def __update(self, user, item, rating, sign):
+        for other, other_rating in self.raters[item].items():
+            if other == user:
+                continue
+
+            key = self.__key(user, other)
+            if key[0] == user:
+                x, y = rating, other_rating
+            else:
+                x, y = other_rating, rating
+
+            stats = self.pairs.get(key)
+            if stats is None:
+                stats = self.pairs[key] = [0, 0, 0, 0, 0, 0, 0]
+                self.partners.setdefault(user, set()).add(other)
+                self.partners.setdefault(other, set()).add(user)
+
+            stats[0] += sign
+            stats[1] += sign * x
+            stats[2] += sign * y
+            stats[3] += sign * x * y
+            stats[4] += sign * pow(x, 2)
+            stats[5] += sign * pow(y, 2)
+            stats[6] += sign * abs(x - y)
+
+            if stats[0] == 0:
+                del self.pairs[key]
+                self.partners[user].discard(other)
+                self.partners[other].discard(user)
+
+def unit_test():
+    # Through random add/remove sequences every pair's statistics must be
+    # the ones its co-ratings give, and only pairs with co-ratings kept
+    data  = {}
+    index = SimilarityIndex()
+    for user, item, rating in random_rating_changes():
+        if rating is None:
+            data.get(user, {}).pop(item, None)
+            index.remove_rating(user, item)
+        else:
+            data.setdefault(user, {})[item] = rating
+            index.add_rating(user, item, rating)
+
+    pairs = {}
+    users = sorted(data)
+    for (a, user1) in enumerate(users):
+        for user2 in users[a + 1:]:
+            common = [k for k in data[user1] if k in data[user2]]
+            if not common:
+                continue
+            x = [data[user1][k] for k in common]
+            y = [data[user2][k] for k in common]
+            pairs[(user1, user2)] = [len(common), sum(x), sum(y),
+                sum([x[i] * y[i] for i in range(len(common))]),
+                sum([pow(v, 2) for v in x]), sum([pow(v, 2) for v in y]),
+                sum([abs(x[i] - y[i]) for i in range(len(common))])]
+    assert(index.pairs == pairs)
+    for user in users:
+        assert(index.partners.get(user, set()) ==
+            set([other for key in pairs if user in key
+                for other in key if other != user]))
+    print('add_rating and remove_rating work correctly')
+
+# unit_test()
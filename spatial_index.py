@@ -0,0 +1,170 @@
+import heapq
+
+from metrics import euclidean, manhattan
+
+# Above this many dimensions a KD-tree prunes little, so try a ball tree
+KD_TREE_MAX_DIMENSIONS = 10
+
+# A ball tree is kept when its sample searches compute at most this
+# fraction of the distances a linear scan does, which pays for the cost of
+# walking the tree in Python
+BALL_TREE_MAX_WORK = 0.5
+SAMPLE_QUERIES     = 20
+
+DISTANCES = {'euclidean': euclidean, 'manhattan': manhattan}
+
+def build_index(points, metric='euclidean', leaf_size=10):
+    """KD-tree for low dimensional points. Otherwise a ball tree if it
+    prunes enough on sample queries to beat a linear scan, which it rarely
+    does on data that really fills many dimensions, and a linear scan if
+    not. All of them give the same neighbors."""
+    if not points or len(points[0]) <= KD_TREE_MAX_DIMENSIONS:
+        return KDTree(points, metric, leaf_size)
+
+    tree = BallTree(points, metric, leaf_size)
+    if tree.work(sample_queries(points)) <= BALL_TREE_MAX_WORK * len(points):
+        return tree
+    return LinearScan(points, metric, leaf_size)
+
+def sample_queries(points, count=SAMPLE_QUERIES):
+    """Midpoints of evenly spread pairs of points: like real queries, near
+    the data without sitting on it."""
+    step = max(len(points) // count, 1)
+    half = len(points) // 2
+    queries = []
+    for i in range(0, len(points), step)[:count]:
+        other = points[(i + half) % len(points)]
+        queries.append([(a + b) / 2.0 for (a, b) in zip(points[i], other)])
+    return queries
+
+class SpatialIndex(object):
+    """Shared k nearest neighbor search. Neighbors come back as
+    (distance, index) sorted by distance and then by index, exactly as a
+    full sort of every point would order them."""
+
+    def __init__(self, points, metric='euclidean', leaf_size=10):
+        self.distance  = DISTANCES[metric]
+        self.leaf_size = leaf_size
+        self.metric    = metric
+        self.points    = points
+        self.root      = self.build(list(range(len(points))))
+
+    def query(self, vector, k=1):
+        heap = []
+        self.search(self.root, vector, k, heap)
+        return sorted([(-item[0], -item[1]) for item in heap])
+
+    def push(self, heap, k, vector, indices):
+        # heap holds the best k so far as (-distance, -index)
+        for index in indices:
+            distance = self.distance(vector, self.points[index])
+            item = (-distance, -index)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def work(self, queries, k=1):
+        """Mean number of distances computed to answer each query."""
+        distance = self.distance
+        count    = [0]
+        def counted(vector1, vector2):
+            count[0] += 1
+            return distance(vector1, vector2)
+
+        self.distance = counted
+        try:
+            for vector in queries:
+                self.query(vector, k)
+        finally:
+            self.distance = distance
+        return count[0] / float(max(len(queries), 1))
+
+    def spread(self, indices):
+        """Dimension the points vary most along."""
+        best = (-1, 0)
+        for dimension in range(len(self.points[indices[0]])):
+            values = [self.points[i][dimension] for i in indices]
+            best = max(best, (max(values) - min(values), dimension))
+        return best[1]
+
+    def worst(self, heap, k):
+        """Distance a subtree has to beat, with a little slack for rounding
+        so points tied with the k-th neighbor are still visited."""
+        if len(heap) < k:
+            return float('inf')
+        return -heap[0][0] * (1 + 1e-12) + 1e-12
+
+class KDTree(SpatialIndex):
+    def build(self, indices):
+        if len(indices) <= self.leaf_size:
+            return ('leaf', indices)
+
+        dimension = self.spread(indices)
+        indices.sort(key=lambda i: self.points[i][dimension])
+        middle = len(indices) // 2
+        split  = self.points[indices[middle]][dimension]
+        return ('node', dimension, split,
+            self.build(indices[:middle]), self.build(indices[middle:]))
+
+    def search(self, node, vector, k, heap):
+        if node[0] == 'leaf':
+            self.push(heap, k, vector, node[1])
+            return
+
+        tag, dimension, split, left, right = node
+        difference = vector[dimension] - split
+        if difference < 0:
+            near, far = left, right
+        else:
+            near, far = right, left
+        self.search(near, vector, k, heap)
+
+        # No point across the split is closer than the split itself, for
+        # euclidean and manhattan alike
+        if abs(difference) <= self.worst(heap, k):
+            self.search(far, vector, k, heap)
+
+class BallTree(SpatialIndex):
+    def build(self, indices):
+        length   = float(len(indices))
+        center   = [sum([self.points[i][d] for i in indices]) / length
+            for d in range(len(self.points[indices[0]]))]
+        radius   = max([self.distance(center, self.points[i])
+            for i in indices])
+
+        if len(indices) <= self.leaf_size:
+            return ('leaf', center, radius, indices)
+
+        dimension = self.spread(indices)
+        indices.sort(key=lambda i: self.points[i][dimension])
+        middle = len(indices) // 2
+        return ('node', center, radius,
+            self.build(indices[:middle]), self.build(indices[middle:]))
+
+    def search(self, node, vector, k, heap):
+        # Nothing in a ball is closer than its surface
+        if self.distance(vector, node[1]) - node[2] > self.worst(heap, k):
+            return
+
+        if node[0] == 'leaf':
+            self.push(heap, k, vector, node[3])
+            return
+
+        children = sorted([node[3], node[4]],
+            key=lambda child: self.distance(vector, child[1]))
+        for child in children:
+            self.search(child, vector, k, heap)
+
+class LinearScan(SpatialIndex):
+    """Every point, for data no tree prunes well enough to pay for itself."""
+
+    def build(self, indices):
+        return ('leaf', indices)
+
+    def query(self, vector, k=1):
+        return heapq.nsmallest(k, [(self.distance(vector, self.points[i]), i)
+            for i in range(len(self.points))])
+
+    def search(self, node, vector, k, heap):
+        self.push(heap, k, vector, node[1])
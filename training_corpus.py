@@ -12,6 +12,7 @@ from naive_bayes import NaiveBayes
 class TrainingCorpus(NaiveBayes):
     def __init__(self, name):
         super(TrainingCorpus, self).__init__(name, [])
+        self.bucket_counts = {}
         self.categories    = []
         self.probabilities = {}
         self.stop_words    = {}
@@ -117,9 +118,40 @@ class TrainingCorpus(NaiveBayes):
 
         self.probabilities = prob
 
+    def count_bucket(self, category, bucket):
+        """(word counts, total) of one category's bucket, read from disk the
+        first time a cross validation run needs them."""
+        key = (category, bucket)
+        if key not in self.bucket_counts:
+            directory = '{}/{}/{}'.format(
+                self.__training_directory_name(), category, bucket
+            )
+            counts = {}
+            total  = 0
+            for name in os.listdir(directory):
+                for word in self.read_words('{}/{}'.format(directory, name)):
+                    counts.setdefault(word, 0)
+                    counts[word] += 1
+                    total += 1
+            self.bucket_counts[key] = (counts, total)
+        return self.bucket_counts[key]
+
     def match_from_text(self, text):
         return re.search(r'[A-Za-z0-9]+', text)
 
+    def read_words(self, path):
+        """Yield the lowercased words of a file that aren't stop words."""
+        f = open(path)
+        for line in f:
+            words = line.split()
+            for text in words:
+                match = self.match_from_text(text)
+                if match:
+                    word = match.group(0).lower()
+                    if word not in self.stop_words:
+                        yield word
+        f.close()
+
     def read_stop_words(self, file_name='stop_words'):
         f = open('sets/{}/{}.txt'.format(self.name, file_name), 'r')
         text = f.read()
@@ -127,6 +159,7 @@ class TrainingCorpus(NaiveBayes):
         self.stop_words = dict.fromkeys(
             [x.strip() for x in text.split('\n') if len(x) > 0], 0
         )
+        self.bucket_counts = {}
 
     def read_training_documents(self):
         self.categories    = os.listdir(self.__training_directory_name())
@@ -153,22 +186,14 @@ class TrainingCorpus(NaiveBayes):
         total  = 0
 
         for name in files:
-            f = open('{}/{}/{}'.format(
+            for word in self.read_words('{}/{}/{}'.format(
                 self.__training_directory_name(), dir_name, name
-            ))
-            for line in f:
-                words = line.split()
-                for text in words:
-                    match = self.match_from_text(text)
-                    if match:
-                        word = match.group(0).lower()
-                        if word not in self.stop_words:
-                            self.vocabulary.setdefault(word, 0)
-                            self.vocabulary[word] += 1
-                            counts.setdefault(word, 0)
-                            counts[word] += 1
-                            total += 1
-            f.close()
+            )):
+                self.vocabulary.setdefault(word, 0)
+                self.vocabulary[word] += 1
+                counts.setdefault(word, 0)
+                counts[word] += 1
+                total += 1
 
         return (counts, total)
 
@@ -190,6 +215,8 @@ class TrainingCorpus(NaiveBayes):
         # 7. Count the correct and divide by the amount of attempts
         self.number_of_buckets = buckets
         self.categories        = os.listdir(self.__training_directory_name())
+        # Each bucket is read once for the whole run, not once per fold
+        self.bucket_counts     = {}
 
         score = 0
         total = 0
@@ -248,38 +275,22 @@ class TrainingCorpus(NaiveBayes):
         return accuracy
 
     def train_category(self, category, exclude_bucket_number):
-        numbers = range(self.number_of_buckets)
-        slice1  = slice(0, exclude_bucket_number)
-        slice2  = slice(exclude_bucket_number + 1, self.number_of_buckets)
-        buckets = numbers[slice1] + numbers[slice2]
-
         counts = {}
         total  = 0
 
         print('Training category: {}'.format(category))
 
-        for bucket in buckets:
-            files = os.listdir('{}/{}/{}'.format(
-                self.__training_directory_name(), category, bucket
-            ))
-
-            for name in files:
-                f = open('{}/{}/{}/{}'.format(
-                    self.__training_directory_name(), category, bucket, name
-                ))
-                for line in f:
-                    words = line.split()
-                    for text in words:
-                        match = self.match_from_text(text)
-                        if match:
-                            word = match.group(0).lower()
-                            if word not in self.stop_words:
-                                self.vocabulary.setdefault(word, 0)
-                                self.vocabulary[word] += 1
-                                counts.setdefault(word, 0)
-                                counts[word] += 1
-                                total += 1
-                f.close()
+        for bucket in range(self.number_of_buckets):
+            if bucket == exclude_bucket_number:
+                continue
+
+            bucket_counts, bucket_total = self.count_bucket(category, bucket)
+            for word, count in bucket_counts.items():
+                self.vocabulary.setdefault(word, 0)
+                self.vocabulary[word] += count
+                counts.setdefault(word, 0)
+                counts[word] += count
+            total += bucket_total
 
         return (counts, total)
 
@@ -0,0 +1,288 @@
+import sys
+
+from array import array
+
+class TrainingSet(object):
+    """Rows of (class, num values, comment fields), stored column-free in
+    flat arrays: a row-major matrix of the values ('d' for float64, 'f'
+    to opt in to float32) and an array of class codes into labels.
+
+    Indexing and iterating give Row views that behave like the
+    (class, vector, comments) tuples Classifier used to keep, vector
+    included, so code written against a list of tuples keeps working.
+    Comments are only materialized when first used."""
+
+    def __init__(self, rows=(), typecode='d', width=None):
+        self.classes   = array('i')
+        self.labels    = []
+        self.label_ids = {}
+        self.values    = array(typecode)
+        self.width     = width
+
+        self.__comments       = []
+        self.__comment_source = None
+
+        self.extend(rows)
+
+    @classmethod
+    def from_columns(cls, columns, typecode=None):
+        """Copy a column_store.Columns, leaving its comments unread."""
+        data = cls(typecode=typecode or columns.values.typecode,
+            width=columns.width)
+        data.classes = array('i', columns.classes)
+        data.labels  = list(columns.labels)
+        data.values  = array(data.values.typecode, columns.values)
+        data.label_ids = dict(
+            (data.labels[i], i) for i in range(len(data.labels))
+        )
+        data.__comment_source = lambda: columns.comments
+        return data
+
+    def __add__(self, rows):
+        data = self.subset(range(len(self)))
+        data.extend(rows)
+        return data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.subset(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('TrainingSet index out of range')
+        return Row(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Row(self, index)
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __radd__(self, rows):
+        data = TrainingSet(rows, self.values.typecode, self.width)
+        data.extend(self)
+        return data
+
+    def __repr__(self):
+        return 'TrainingSet({} rows x {} columns, {})'.format(
+            len(self), self.width, self.values.typecode)
+
+    @property
+    def comments(self):
+        if self.__comment_source is not None:
+            self.__comments = [list(c) for c in self.__comment_source()]
+            self.__comment_source = None
+        return self.__comments
+
+    def append(self, row):
+        label, vector, comment = row[0], row[1], row[2]
+        vector = list(vector)
+        if self.width is None:
+            self.width = len(vector)
+        elif len(vector) != self.width:
+            raise ValueError('Expected {} values, got {}'.format(
+                self.width, len(vector)))
+
+        if label not in self.label_ids:
+            self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        self.comments.append(list(comment))
+        self.classes.append(self.label_ids[label])
+        self.values.extend(vector)
+
+    def column(self, number):
+        """Values of one column as a list."""
+        return self.values[number::self.width].tolist()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def label(self, index):
+        return self.labels[self.classes[index]]
+
+    def memory_footprint(self):
+        """Bytes held by each part, and their total. Comments count as
+        nothing until they are materialized."""
+        footprint = {
+            'classes': self.classes.itemsize * len(self.classes),
+            'comments': 0,
+            'labels': sys.getsizeof(self.labels) + sum(
+                [sys.getsizeof(label) for label in self.labels]),
+            'values': self.values.itemsize * len(self.values),
+        }
+        if self.__comment_source is None:
+            footprint['comments'] = _nested_size(self.__comments)
+        footprint['total'] = sum(footprint.values())
+        return footprint
+
+    def set_column(self, number, values):
+        if len(values) != len(self):
+            raise ValueError('Expected {} values, got {}'.format(
+                len(self), len(values)))
+        self.values[number::self.width] = array(self.values.typecode, values)
+
+    def subset(self, indices):
+        """New set of the rows at indices, e.g. one fold's rows."""
+        data = TrainingSet(typecode=self.values.typecode, width=self.width)
+        data.labels    = list(self.labels)
+        data.label_ids = dict(self.label_ids)
+        comments = self.comments
+        for index in indices:
+            start = index * self.width
+            data.classes.append(self.classes[index])
+            data.values.extend(self.values[start:start + self.width])
+            data.__comments.append(list(comments[index]))
+        return data
+
+class Row(object):
+    """View of one row, indexed and compared like its tuple."""
+
+    __slots__ = ('data', 'index')
+
+    def __init__(self, data, index):
+        self.data  = data
+        self.index = index
+
+    def __getitem__(self, key):
+        if key < 0:
+            key += 3
+        if key == 0:
+            return self.data.label(self.index)
+        elif key == 1:
+            start = self.index * self.data.width
+            return RowVector(self.data.values, start, start + self.data.width)
+        elif key == 2:
+            return self.data.comments[self.index]
+        raise IndexError('Row index out of range')
+
+    def __iter__(self):
+        for key in range(3):
+            yield self[key]
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return repr((self[0], self.vector(), self[2]))
+
+    # Rows order like tuples, field by field, so sorting ties between
+    # equally distant rows breaks them as before
+    def __eq__(self, other):
+        return self.__compare(other) == 0
+
+    def __ge__(self, other):
+        return self.__compare(other) >= 0
+
+    def __gt__(self, other):
+        return self.__compare(other) > 0
+
+    def __le__(self, other):
+        return self.__compare(other) <= 0
+
+    def __lt__(self, other):
+        return self.__compare(other) < 0
+
+    def __ne__(self, other):
+        return self.__compare(other) != 0
+
+    __hash__ = None
+
+    def vector(self):
+        """Copy of the row's values as a list."""
+        start = self.index * self.data.width
+        return self.data.values[start:start + self.data.width].tolist()
+
+    # Private methods
+
+    def __compare(self, other):
+        # Comments are only looked at when everything before them ties
+        for key in range(3):
+            if key == 1:
+                mine   = self.vector()
+                theirs = list(other[1])
+            else:
+                mine   = self[key]
+                theirs = other[key]
+            if mine != theirs:
+                return -1 if mine < theirs else 1
+        return 0
+
+class RowVector(object):
+    """View of a row's values that reads and writes the shared matrix, so
+    scaling a column in place scales the set."""
+
+    __slots__ = ('start', 'stop', 'values')
+
+    def __init__(self, values, start, stop):
+        self.start  = start
+        self.stop   = stop
+        self.values = values
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.values[self.start:self.stop].tolist()[index]
+        return self.values[self.start + self.__offset(index)]
+
+    def __iter__(self):
+        return iter(self.values[self.start:self.stop])
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __lt__(self, other):
+        return list(self) < list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            values = self.values[self.start:self.stop].tolist()
+            values[index] = value
+            if len(values) != len(self):
+                raise ValueError('A row vector cannot change length')
+            self.values[self.start:self.stop] = array(
+                self.values.typecode, values)
+        else:
+            self.values[self.start + self.__offset(index)] = value
+
+    __hash__ = None
+
+    # Private methods
+
+    def __offset(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Row vector index out of range')
+        return index
+
+def _nested_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum([_nested_size(item) for item in value])
+    return size
+
+def row_list_footprint(rows):
+    """Bytes a list of (class, vector, comments) tuples would take, to
+    compare with TrainingSet.memory_footprint. Shared strings are counted
+    every time they appear."""
+    return _nested_size([(row[0], list(row[1]), list(row[2])) for row in rows])
+
+if __name__ == '__main__':
+    from column_store import parse_columns
+
+    for typecode in ['d', 'f']:
+        columns = parse_columns('sets/mpg_test_set.txt', typecode)
+        data    = TrainingSet.from_columns(columns)
+        print('{}: {} bytes as a TrainingSet, {} as a list of tuples'.format(
+            typecode, data.memory_footprint()['total'],
+            row_list_footprint(data)))